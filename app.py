@@ -5,16 +5,20 @@ REST API with face recognition, role-based auth, and attendance tracking
 
 import os
 import sys
-import base64
-import cv2
-import numpy as np
-from datetime import datetime
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from datetime import datetime, timedelta
+from flask import Flask, request, jsonify, render_template, send_from_directory, g
 from flask_cors import CORS
 from flask_jwt_extended import (
     JWTManager, create_access_token, get_jwt_identity,
     verify_jwt_in_request
 )
+from sqlalchemy import func, case
+
+try:
+    import orjson
+except ImportError:
+    import json
+    orjson = None
 
 # Add current directory to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -22,16 +26,17 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from config import (
     SECRET_KEY, JWT_SECRET_KEY, JWT_ACCESS_TOKEN_EXPIRES,
     SQLALCHEMY_DATABASE_URI, SQLALCHEMY_TRACK_MODIFICATIONS,
-    FACE_MATCH_TOLERANCE, LIVENESS_ENABLED
+    FACE_MATCH_TOLERANCE, LIVENESS_ENABLED,
+    HEAD_MOVEMENT_ENABLED, LIVENESS_CHALLENGE_MODE
 )
 from models import db, init_db, User, AttendanceLog, LoginAttempt
 from decorators import login_required, admin_required, get_current_user
-from face_utils import detect_faces, encode_face, find_best_match
-from liveness import verify_liveness_api
+from face_utils import analyze_face_image, run_face_task, find_best_match
 from database import (
-    save_user_to_db, get_all_users_with_faces, get_user_by_username,
-    log_attendance, log_logout, get_user_active_session, get_attendance_logs,
-    log_login_attempt, update_user_face_encoding
+    save_user_to_db, get_all_users_with_faces, get_user_by_username, get_user_rows,
+    log_attendance, log_logout, get_user_active_session, get_attendance_rows,
+    get_login_attempt_rows, log_login_attempt, update_user_face_encoding, invalidate_face_cache,
+    uncache_face_encoding
 )
 
 # =============================================================================
@@ -56,20 +61,20 @@ jwt = JWTManager(app)
 # Helper Functions
 # =============================================================================
 
-def decode_base64_image(base64_string):
-    """Decode base64 image to OpenCV format."""
-    try:
-        # Remove data URL prefix if present
-        if ',' in base64_string:
-            base64_string = base64_string.split(',')[1]
-        
-        img_bytes = base64.b64decode(base64_string)
-        nparr = np.frombuffer(img_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        return image
-    except Exception as e:
-        print(f"Error decoding image: {e}")
-        return None
+# Responses for analyze_face_image() failures
+REGISTER_FACE_ERRORS = {
+    'invalid_image': 'Invalid face image',
+    'no_face_detected': 'No face detected in image',
+    'multiple_faces': 'Multiple faces detected. Please use an image with only one face.',
+    'encoding_failed': 'Failed to encode face',
+}
+
+LOGIN_FACE_ERRORS = {
+    'invalid_image': ('Invalid image data', 400),
+    'liveness_failed': ('Liveness check failed: {msg}', 401),
+    'no_face_detected': ('No face detected', 400),
+    'encoding_failed': ('Failed to process face', 400),
+}
 
 
 def get_client_info():
@@ -79,6 +84,57 @@ def get_client_info():
     return ip_address, user_agent
 
 
+def get_face_upload():
+    """
+    Read request fields and the face image from any supported upload format.
+    
+    The image can be sent as a raw image/* body, as a 'face_image' file in a
+    multipart form, or base64 encoded in a JSON body (the original format).
+    
+    Returns:
+        Tuple of (fields: dict-like, face_image: bytes or base64 str)
+    """
+    if request.mimetype.startswith('image/'):
+        return {}, request.get_data(cache=False)
+    
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('face_image')
+        return request.form, upload.read() if upload else b''
+    
+    data = request.get_json()
+    return data, data.get('face_image', '')
+
+
+def get_day_boundaries():
+    """
+    Get the start of the current UTC day and the point 7 days before it.
+    
+    login_time and timestamp columns are stored in UTC, so "today" starts at
+    UTC midnight. Computed once per request and kept on flask.g.
+    
+    Returns:
+        Tuple of (today: datetime, week_ago: datetime)
+    """
+    if 'day_boundaries' not in g:
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        g.day_boundaries = (today, today - timedelta(days=7))
+    return g.day_boundaries
+
+
+def json_response(payload, status=200):
+    """
+    Serialize a large listing with orjson when available.
+    
+    Datetimes are written as ISO 8601 either way, matching the
+    isoformat() strings the model to_dict() methods produce.
+    """
+    if orjson is not None:
+        body = orjson.dumps(payload)
+    else:
+        body = json.dumps(payload, default=lambda o: o.isoformat())
+    return app.response_class(body, status=status, mimetype='application/json')
+
+
 # =============================================================================
 # Web Routes (HTML Pages)
 # =============================================================================
@@ -130,15 +186,17 @@ def api_register():
             "role": "user",
             "face_image": "base64_encoded_image"
         }
+    
+    The same fields can be sent as multipart/form-data with face_image as
+    a file upload, which avoids the base64 overhead.
     """
     try:
-        data = request.get_json()
+        data, face_image = get_face_upload()
         
         username = data.get('username', '').strip()
         email = data.get('email', '').strip()
         password = data.get('password', '')
         role = data.get('role', 'user')
-        face_image_b64 = data.get('face_image', '')
         
         # Validation
         if not username or len(username) < 2:
@@ -164,35 +222,16 @@ def api_register():
                 'message': 'Username or email already registered'
             }), 409
         
-        # Process face image
+        # Process face image (decode, detect and encode)
         encoding = None
-        if face_image_b64:
-            image = decode_base64_image(face_image_b64)
-            if image is None:
-                return jsonify({
-                    'success': False,
-                    'message': 'Invalid face image'
-                }), 400
-            
-            # Detect and encode face
-            faces = detect_faces(image)
-            if not faces:
-                return jsonify({
-                    'success': False,
-                    'message': 'No face detected in image'
-                }), 400
-            
-            if len(faces) > 1:
-                return jsonify({
-                    'success': False,
-                    'message': 'Multiple faces detected. Please use an image with only one face.'
-                }), 400
-            
-            encoding = encode_face(image, faces[0])
-            if encoding is None:
+        if face_image:
+            failure, encoding, _, _ = run_face_task(
+                analyze_face_image, face_image, single_face=True
+            )
+            if failure:
                 return jsonify({
                     'success': False,
-                    'message': 'Failed to encode face'
+                    'message': REGISTER_FACE_ERRORS[failure]
                 }), 400
         
         # Only admins can create admin users
@@ -236,66 +275,37 @@ def api_login_face():
         {
             "face_image": "base64_encoded_image"
         }
+    
+    Or the raw image as the request body (Content-Type: image/jpeg etc.),
+    or a multipart form with a face_image file.
     """
     try:
-        data = request.get_json()
-        face_image_b64 = data.get('face_image', '')
+        _, face_image = get_face_upload()
         
-        if not face_image_b64:
+        if not face_image:
             return jsonify({
                 'success': False,
                 'message': 'Face image required'
             }), 400
         
-        # Decode image
-        image = decode_base64_image(face_image_b64)
-        if image is None:
-            ip, ua = get_client_info()
-            log_login_attempt(attempt_type='face', failure_reason='invalid_image', 
-                            ip_address=ip, user_agent=ua)
-            return jsonify({
-                'success': False,
-                'message': 'Invalid image data'
-            }), 400
-        
-        # Liveness check
-        liveness_score = 0.0
-        if LIVENESS_ENABLED:
-            is_live, liveness_score, msg = verify_liveness_api(image)
-            if not is_live:
-                ip, ua = get_client_info()
-                log_login_attempt(attempt_type='face', failure_reason='liveness_failed',
-                                ip_address=ip, user_agent=ua)
-                return jsonify({
-                    'success': False,
-                    'message': f'Liveness check failed: {msg}'
-                }), 401
-        
-        # Detect face
-        faces = detect_faces(image)
-        if not faces:
-            ip, ua = get_client_info()
-            log_login_attempt(attempt_type='face', failure_reason='no_face_detected',
-                            ip_address=ip, user_agent=ua)
-            return jsonify({
-                'success': False,
-                'message': 'No face detected'
-            }), 400
+        # Decode, liveness-check, detect and encode in one step
+        failure, encoding, liveness_score, msg = run_face_task(
+            analyze_face_image, face_image, check_liveness=LIVENESS_ENABLED
+        )
         
-        # Encode face
-        encoding = encode_face(image, faces[0])
-        if encoding is None:
+        if failure:
             ip, ua = get_client_info()
-            log_login_attempt(attempt_type='face', failure_reason='encoding_failed',
+            log_login_attempt(attempt_type='face', failure_reason=failure,
                             ip_address=ip, user_agent=ua)
+            message, status = LOGIN_FACE_ERRORS[failure]
             return jsonify({
                 'success': False,
-                'message': 'Failed to process face'
-            }), 400
+                'message': message.format(msg=msg)
+            }), status
         
         # Find matching user
         known_faces = get_all_users_with_faces()
-        if not known_faces:
+        if not known_faces[0]:
             return jsonify({
                 'success': False,
                 'message': 'No registered users with face data'
@@ -331,24 +341,23 @@ def api_login_face():
                 'message': 'Account is disabled'
             }), 403
         
-        # Update last login
-        user.last_login = datetime.utcnow()
-        db.session.commit()
+        # Update last login, log the attempt and open attendance in one commit
+        user.mark_login()
         
-        # Log successful attempt
         ip_address, user_agent = get_client_info()
         log_login_attempt(user_id=user.id, attempt_type='face', success=True,
-                         ip_address=ip_address, user_agent=user_agent)
+                         ip_address=ip_address, user_agent=user_agent, commit=False)
         
-        # Create attendance log
         attendance = log_attendance(
             user_id=user.id,
             login_method='face',
             liveness_score=liveness_score,
             face_confidence=confidence,
             ip_address=ip_address,
-            user_agent=user_agent
+            user_agent=user_agent,
+            commit=False
         )
+        db.session.commit()
         
         # Generate JWT token (use str for identity for compatibility)
         access_token = create_access_token(identity=str(user.id))
@@ -425,21 +434,24 @@ def api_login_password():
                 'message': 'Account is disabled'
             }), 403
         
-        # Update last login
-        user.last_login = datetime.utcnow()
-        db.session.commit()
+        # Upgrade a hash made with fewer rounds than the user's role needs
+        if user.password_needs_rehash():
+            user.set_password(password)
+        
+        # Update last login, log the attempt and open attendance in one commit
+        user.mark_login()
         
-        # Log successful attempt
         log_login_attempt(user_id=user.id, attempt_type='password', success=True,
-                         ip_address=ip_address, user_agent=user_agent)
+                         ip_address=ip_address, user_agent=user_agent, commit=False)
         
-        # Create attendance log
         attendance = log_attendance(
             user_id=user.id,
             login_method='password',
             ip_address=ip_address,
-            user_agent=user_agent
+            user_agent=user_agent,
+            commit=False
         )
+        db.session.commit()
         
         # Generate JWT token (use str for identity for compatibility)
         access_token = create_access_token(identity=str(user.id))
@@ -518,16 +530,13 @@ def api_list_users():
     try:
         role = request.args.get('role', None)
         
-        if role:
-            users = User.query.filter_by(role=role).all()
-        else:
-            users = User.query.all()
+        users = get_user_rows(role=role)
         
-        return jsonify({
+        return json_response({
             'success': True,
-            'users': [u.to_dict() for u in users],
+            'users': users,
             'total': len(users)
-        }), 200
+        })
         
     except Exception as e:
         return jsonify({
@@ -585,6 +594,13 @@ def api_update_user(user_id):
         
         db.session.commit()
         
+        # The active flag decides who face login can match
+        if 'is_active' in data:
+            if user.is_active:
+                invalidate_face_cache()
+            else:
+                uncache_face_encoding(user.username)
+        
         return jsonify({
             'success': True,
             'message': 'User updated',
@@ -621,6 +637,7 @@ def api_delete_user(user_id):
         username = user.username
         db.session.delete(user)
         db.session.commit()
+        uncache_face_encoding(username)
         
         return jsonify({
             'success': True,
@@ -653,13 +670,13 @@ def api_get_attendance():
         
         limit = request.args.get('limit', 100, type=int)
         
-        logs = get_attendance_logs(user_id=user_id, limit=limit)
+        logs = get_attendance_rows(user_id=user_id, limit=limit)
         
-        return jsonify({
+        return json_response({
             'success': True,
-            'logs': [log.to_dict() for log in logs],
+            'logs': logs,
             'total': len(logs)
-        }), 200
+        })
         
     except Exception as e:
         return jsonify({
@@ -673,19 +690,16 @@ def api_get_attendance():
 def api_attendance_today():
     """Get today's attendance (admin only)."""
     try:
-        from datetime import date
-        today = datetime.combine(date.today(), datetime.min.time())
+        today, _ = get_day_boundaries()
         
-        logs = AttendanceLog.query.filter(
-            AttendanceLog.login_time >= today
-        ).order_by(AttendanceLog.login_time.desc()).all()
+        logs = get_attendance_rows(start_date=today, limit=None)
         
-        return jsonify({
+        return json_response({
             'success': True,
-            'logs': [log.to_dict() for log in logs],
+            'logs': logs,
             'total': len(logs),
             'date': today.strftime('%Y-%m-%d')
-        }), 200
+        })
         
     except Exception as e:
         return jsonify({
@@ -702,18 +716,13 @@ def api_login_attempts():
         success = request.args.get('success', type=lambda x: x.lower() == 'true')
         limit = request.args.get('limit', 100, type=int)
         
-        query = LoginAttempt.query
-        
-        if success is not None:
-            query = query.filter_by(success=success)
+        attempts = get_login_attempt_rows(success=success, limit=limit)
         
-        attempts = query.order_by(LoginAttempt.timestamp.desc()).limit(limit).all()
-        
-        return jsonify({
+        return json_response({
             'success': True,
-            'attempts': [a.to_dict() for a in attempts],
+            'attempts': attempts,
             'total': len(attempts)
-        }), 200
+        })
         
     except Exception as e:
         return jsonify({
@@ -731,39 +740,41 @@ def api_login_attempts():
 def api_stats():
     """Get system statistics (admin only)."""
     try:
-        from datetime import date, timedelta
-        today = datetime.combine(date.today(), datetime.min.time())
-        week_ago = today - timedelta(days=7)
-        
-        total_users = User.query.count()
-        active_users = User.query.filter_by(is_active=True).count()
-        admin_count = User.query.filter_by(role='admin').count()
-        
-        today_logins = AttendanceLog.query.filter(
-            AttendanceLog.login_time >= today
-        ).count()
-        
-        week_logins = AttendanceLog.query.filter(
-            AttendanceLog.login_time >= week_ago
-        ).count()
+        today, week_ago = get_day_boundaries()
+        
+        # One aggregate query per table instead of one COUNT per statistic
+        total_users, active_users, admin_count = db.session.query(
+            func.count(User.id),
+            func.sum(case((User.is_active == True, 1), else_=0)),
+            func.sum(case((User.role == 'admin', 1), else_=0))
+        ).one()
+        
+        # Restricted to the last week so the login_time index bounds the scan
+        today_logins, week_logins = db.session.query(
+            func.sum(case((AttendanceLog.login_time >= today, 1), else_=0)),
+            func.count(AttendanceLog.id)
+        ).filter(AttendanceLog.login_time >= week_ago).one()
+        
+        # Open sessions can be older than a week; counted on the is_active index
+        active_sessions = db.session.query(func.count(AttendanceLog.id)).filter(
+            AttendanceLog.is_active == True
+        ).scalar()
         
         failed_attempts = LoginAttempt.query.filter(
             LoginAttempt.success == False,
             LoginAttempt.timestamp >= today
         ).count()
         
-        active_sessions = AttendanceLog.query.filter_by(is_active=True).count()
-        
         return jsonify({
             'success': True,
             'stats': {
                 'total_users': total_users,
-                'active_users': active_users,
-                'admin_count': admin_count,
-                'today_logins': today_logins,
-                'week_logins': week_logins,
+                'active_users': active_users or 0,
+                'admin_count': admin_count or 0,
+                'today_logins': today_logins or 0,
+                'week_logins': week_logins or 0,
                 'failed_attempts_today': failed_attempts,
-                'active_sessions': active_sessions
+                'active_sessions': active_sessions or 0
             }
         }), 200
         
@@ -783,17 +794,9 @@ def api_stats():
 def api_get_settings():
     """Get system settings (admin only)."""
     try:
-        from config import (
-            FACE_RECOGNITION_MODEL, FACE_ENCODING_JITTERS,
-            FACE_MATCH_TOLERANCE, LIVENESS_ENABLED,
-            HEAD_MOVEMENT_ENABLED, LIVENESS_CHALLENGE_MODE
-        )
-        
         return jsonify({
             'success': True,
             'settings': {
-                'face_recognition_model': FACE_RECOGNITION_MODEL,
-                'face_encoding_jitters': FACE_ENCODING_JITTERS,
                 'face_match_tolerance': FACE_MATCH_TOLERANCE,
                 'liveness_enabled': LIVENESS_ENABLED,
                 'head_movement_enabled': HEAD_MOVEMENT_ENABLED,
@@ -841,7 +844,12 @@ if __name__ == '__main__':
     print("="*60)
     print(f"  Server: http://localhost:5000")
     print(f"  API Docs: http://localhost:5000/api")
+    print("="*60)
+    print("  Development server - for production run:")
+    print("  gunicorn wsgi:app -w $(nproc) -k gthread --threads 8 --preload")
     print("="*60 + "\n")
     
-    # Run Flask app
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Debugger/reloader only when explicitly developing
+    # (FLASK_ENV is deprecated and no longer read by Flask; use FLASK_DEBUG=1)
+    debug = os.environ.get('FLASK_DEBUG', '').lower() in ('1', 'true', 'yes')
+    app.run(host='0.0.0.0', port=5000, debug=debug, threaded=True)
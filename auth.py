@@ -4,14 +4,14 @@ Handles user registration and login with face recognition
 """
 
 import cv2
-import time
 import numpy as np
 from face_utils import (
-    get_camera, capture_frame, detect_faces, encode_face,
-    find_best_match, draw_face_box
+    get_camera, capture_frame, read_fresh_frame, detect_faces_downscaled,
+    detect_faces_with_gray, encode_face,
+    FaceDetectionWorker, find_best_match, match_confidence, draw_face_box
 )
 from database import (
-    save_user, load_users, user_exists, delete_user as db_delete_user,
+    save_user, load_user_matrix, get_user_encoding, user_exists, delete_user as db_delete_user,
     list_users, get_user_count
 )
 from liveness import verify_liveness
@@ -20,6 +20,7 @@ from config import (
     REGISTRATION_DELAY,
     FACE_MATCH_TOLERANCE,
     LIVENESS_ENABLED,
+    CAMERA_WARMUP,
     SHOW_PREVIEW,
     PREVIEW_WINDOW_NAME
 )
@@ -48,60 +49,79 @@ def register_user(username):
     except RuntimeError as e:
         return False, str(e)
     
-    encodings = []
+    # Running mean of the captured encodings (no list of every frame kept)
+    average_encoding = None
     frames_captured = 0
     
+    # Space captures REGISTRATION_DELAY apart by skipping frames rather than sleeping
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    frames_to_skip = int(REGISTRATION_DELAY * fps)
+    
+    # Detection runs on a worker thread while this loop keeps reading frames
+    # and updating the preview. The user holds still, so after the first
+    # detection it only searches around the last face position.
+    detector = FaceDetectionWorker(detect_faces_downscaled, track=True)
+    frame_number = 0
+    last_result = 0
+    next_capture = 0
+    faces = []
+    
     try:
         while frames_captured < REGISTRATION_FRAMES:
-            ret, frame = cap.read()
+            # Reuse a frame array the detector is done with
+            ret, frame = cap.read(detector.get_buffer())
             if not ret:
                 continue
             
-            # Detect faces
-            faces = detect_faces(frame)
-            
-            display_frame = frame.copy()
+            frame_number += 1
+            detector.submit(frame_number, frame)
             
-            if len(faces) == 0:
-                cv2.putText(display_frame, "No face detected - Position your face", (10, 30),
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-            elif len(faces) > 1:
-                cv2.putText(display_frame, "Multiple faces - Only one person please", (10, 30),
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 165, 255), 2)
-                for face in faces:
-                    draw_face_box(display_frame, face, "", (0, 165, 255))
-            else:
-                # Single face detected
-                face = faces[0]
-                draw_face_box(display_frame, face, f"Capturing... {frames_captured+1}/{REGISTRATION_FRAMES}", (0, 255, 0))
-                
-                # Encode face
-                encoding = encode_face(frame, face)
+            result = detector.latest()
+            if result is not None and result[0] != last_result:
+                last_result, detected_frame, faces = result
                 
-                if encoding is not None:
-                    encodings.append(encoding)
-                    frames_captured += 1
-                    print(f"  ✓ Frame {frames_captured}/{REGISTRATION_FRAMES} captured")
-                    time.sleep(REGISTRATION_DELAY)
+                if len(faces) == 1 and last_result >= next_capture:
+                    # Single face detected - encode the frame it was found in
+                    encoding = encode_face(detected_frame, faces[0])
+                    
+                    if encoding is not None:
+                        frames_captured += 1
+                        if average_encoding is None:
+                            average_encoding = encoding.astype(np.float32)
+                        else:
+                            average_encoding += (encoding - average_encoding) / frames_captured
+                        next_capture = last_result + frames_to_skip + 1
+                        print(f"  ✓ Frame {frames_captured}/{REGISTRATION_FRAMES} captured")
             
             if SHOW_PREVIEW:
-                cv2.putText(display_frame, f"Registration: {username}", (10, display_frame.shape[0] - 10),
+                # Draw on a copy - the worker may still be reading this frame
+                frame = frame.copy()
+                if len(faces) == 0:
+                    cv2.putText(frame, "No face detected - Position your face", (10, 30),
+                               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+                elif len(faces) > 1:
+                    cv2.putText(frame, "Multiple faces - Only one person please", (10, 30),
+                               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 165, 255), 2)
+                    for face in faces:
+                        draw_face_box(frame, face, "", (0, 165, 255))
+                else:
+                    draw_face_box(frame, faces[0], f"Capturing... {frames_captured}/{REGISTRATION_FRAMES}", (0, 255, 0))
+                
+                cv2.putText(frame, f"Registration: {username}", (10, frame.shape[0] - 10),
                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
-                cv2.imshow(PREVIEW_WINDOW_NAME, display_frame)
+                cv2.imshow(PREVIEW_WINDOW_NAME, frame)
             
-            if cv2.waitKey(1) & 0xFF == ord('q'):
+            if SHOW_PREVIEW and cv2.waitKey(1) & 0xFF == ord('q'):
                 break
         
     finally:
+        detector.stop()
         cap.release()
         cv2.destroyAllWindows()
     
-    if len(encodings) < REGISTRATION_FRAMES:
+    if frames_captured < REGISTRATION_FRAMES:
         return False, "Failed to capture enough frames. Please try again."
     
-    # Average all encodings for a more robust representation
-    average_encoding = np.mean(encodings, axis=0)
-    
     # Save to database
     if save_user(username, average_encoding):
         return True, f"✓ User '{username}' registered successfully!"
@@ -116,9 +136,10 @@ def login():
     Returns:
         Tuple of (success: bool, username: str or None, confidence: float)
     """
-    users = load_users()
+    # (usernames, matrix) - matched against every user in one vectorized pass
+    users = load_user_matrix()
     
-    if not users:
+    if not users[0]:
         print("\n⚠ No users registered. Please register first.")
         return False, None, 0.0
     
@@ -145,19 +166,18 @@ def login():
         else:
             # Just capture a frame
             print("Capturing face...")
-            time.sleep(1)
-            ret, frame = cap.read()
+            ret, frame = read_fresh_frame(cap, warmup=CAMERA_WARMUP)
             if not ret:
                 return False, None, 0.0
         
         # Detect and encode face
-        faces = detect_faces(frame)
+        faces, gray = detect_faces_with_gray(frame)
         
         if not faces:
             print("✗ No face detected in captured frame.")
             return False, None, 0.0
         
-        encoding = encode_face(frame, faces[0])
+        encoding = encode_face(gray, faces[0])
         
         if encoding is None:
             print("✗ Could not encode face.")
@@ -167,25 +187,26 @@ def login():
         username, distance, confidence = find_best_match(encoding, users, FACE_MATCH_TOLERANCE)
         
         # Show result
-        display_frame = frame.copy()
-        
         if username:
-            draw_face_box(display_frame, faces[0], f"{username} ({confidence:.1f}%)", (0, 255, 0))
-            cv2.putText(display_frame, "ACCESS GRANTED", (10, 30),
-                       cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
             print(f"\n✓ Welcome, {username}!")
             print(f"  Confidence: {confidence:.1f}%")
             print(f"  Distance: {distance:.4f}")
         else:
-            draw_face_box(display_frame, faces[0], "Unknown", (0, 0, 255))
-            cv2.putText(display_frame, "ACCESS DENIED", (10, 30),
-                       cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
             print(f"\n✗ Access Denied - Unknown face")
             print(f"  Closest distance: {distance:.4f}")
             print(f"  (Threshold: {FACE_MATCH_TOLERANCE})")
         
         if SHOW_PREVIEW:
-            cv2.imshow(PREVIEW_WINDOW_NAME, display_frame)
+            # The frame is not used again, so draw the result on it directly
+            if username:
+                draw_face_box(frame, faces[0], f"{username} ({confidence:.1f}%)", (0, 255, 0))
+                cv2.putText(frame, "ACCESS GRANTED", (10, 30),
+                           cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+            else:
+                draw_face_box(frame, faces[0], "Unknown", (0, 0, 255))
+                cv2.putText(frame, "ACCESS DENIED", (10, 30),
+                           cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+            cv2.imshow(PREVIEW_WINDOW_NAME, frame)
             cv2.waitKey(2000)  # Show result for 2 seconds
         
         return username is not None, username, confidence
@@ -205,9 +226,9 @@ def verify_specific_user(username):
     Returns:
         Tuple of (verified: bool, confidence: float)
     """
-    users = load_users()
+    user_encoding = get_user_encoding(username)
     
-    if username not in users:
+    if user_encoding is None:
         print(f"\n⚠ User '{username}' is not registered.")
         return False, 0.0
     
@@ -229,29 +250,29 @@ def verify_specific_user(username):
                 print("\n✗ Liveness check failed.")
                 return False, 0.0
         else:
-            time.sleep(1)
-            ret, frame = cap.read()
+            ret, frame = read_fresh_frame(cap, warmup=CAMERA_WARMUP)
             if not ret:
                 return False, 0.0
         
         # Encode face
-        faces = detect_faces(frame)
+        faces, gray = detect_faces_with_gray(frame)
         
         if not faces:
             print("✗ No face detected.")
             return False, 0.0
         
-        encoding = encode_face(frame, faces[0])
+        encoding = encode_face(gray, faces[0])
         
         if encoding is None:
             return False, 0.0
         
-        # Compare with specific user
-        known_encoding = np.array(users[username])
-        distance = np.linalg.norm(known_encoding - encoding)
-        
-        is_match = distance <= FACE_MATCH_TOLERANCE
-        confidence = max(0, (FACE_MATCH_TOLERANCE - distance) / FACE_MATCH_TOLERANCE) * 100 if is_match else 0
+        # Compare with specific user by euclidean (L2) distance; compared
+        # squared, so the square root is only taken for the reported distance
+        diff = np.subtract(user_encoding, encoding, dtype=np.float32)
+        sq_dist = float(diff @ diff)
+        is_match = sq_dist <= FACE_MATCH_TOLERANCE ** 2
+        distance = float(np.sqrt(sq_dist))
+        confidence = match_confidence(distance, FACE_MATCH_TOLERANCE) if is_match else 0.0
         
         if is_match:
             print(f"\n✓ Verified: You are {username}")
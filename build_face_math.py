@@ -0,0 +1,37 @@
+"""
+Ahead-of-time build of the face matching kernels
+Compiles the Numba kernels in face_math.py into the face_math_aot extension
+module, so the app and CLI start without importing Numba or JIT-compiling.
+
+Run once after installing (and again after changing face_math.py or FACE_SIZE):
+    python build_face_math.py
+"""
+
+import os
+import sys
+
+from config import BASE_DIR
+
+# Make face_math define its Numba kernels even if an old build is present
+sys.modules['face_math_aot'] = None
+
+from numba.pycc import CC
+import face_math
+
+cc = CC('face_math_aot')
+cc.output_dir = BASE_DIR
+# Tune for this machine's CPU (like the JIT does); build on the target host
+cc.target_cpu = 'host'
+
+# pycc compiles serially; prange loops run as plain range loops
+cc.export('batch_sqeuclid', 'Tuple((i8, f4))(f4[:, ::1], f4[::1])')(
+    face_math._batch_sqeuclid_numba.py_func
+)
+cc.export('quantized_sq_distances', 'f4[::1](i1[::1], f4, f4, i1[:, ::1], f4[::1], f4[::1])')(
+    face_math._quantized_sq_distances_numba.py_func
+)
+
+
+if __name__ == "__main__":
+    cc.compile()
+    print(f"[OK] Built {os.path.join(cc.output_dir, cc.output_file)}")
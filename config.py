@@ -10,7 +10,8 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # Data storage (Legacy - for CLI mode)
 DATA_DIR = os.path.join(BASE_DIR, "data")
-USERS_FILE = os.path.join(DATA_DIR, "users.json")
+USERS_FILE = os.path.join(DATA_DIR, "users.npz")  # Binary encoding store
+LEGACY_USERS_FILE = os.path.join(DATA_DIR, "users.json")  # Converted to USERS_FILE on first load
 
 # =============================================================================
 # MySQL Database Settings (Unused - Switched to SQLite)
@@ -31,6 +32,11 @@ SECRET_KEY = os.environ.get("SECRET_KEY", "face-login-secret-key-change-in-produ
 JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "jwt-secret-key-change-in-production")
 JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=24)
 
+# bcrypt work factor for new password hashes; each step doubles hashing
+# time (12 is ~250 ms). Lower it (e.g. BCRYPT_ROUNDS=10) only for dev/test -
+# admin passwords always get at least 12. Existing hashes keep their cost.
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+
 # =============================================================================
 # User Roles
 # =============================================================================
@@ -47,9 +53,69 @@ DEFAULT_ADMIN_PASSWORD = "admin123"  # Change on first login!
 # FACE_ENCODING_JITTERS = 3  # Removed: Not used in OpenCV-only mode
 FACE_MATCH_TOLERANCE = 0.5  # Lower = stricter (default is 0.6)
 
+# Face crops are resized to this size before flattening into an encoding.
+# Changing this invalidates every stored encoding.
+FACE_SIZE = (64, 64)
+
+# Uploaded image decoding (Web API)
+# 1 = full resolution, 2/4/8 = let the JPEG/PNG decoder downscale while decoding.
+# Changing this alters the encodings produced, so re-register users afterwards.
+IMAGE_DECODE_REDUCTION = 1
+
+# Worker processes for decoding/detecting/encoding uploaded faces (Web API).
+# 0 = run in the request thread; e.g. os.cpu_count() to scale past the GIL
+FACE_WORKER_PROCESSES = 0
+
+# Results of analyzing the most recent uploads are kept (keyed by a hash of
+# the image data) so a repeated or retried upload skips decode and detection.
+# Uploads that need a liveness check are always analyzed afresh.
+ANALYZE_CACHE_SIZE = 64
+
+# Face detection runs on a copy downscaled to at most this many pixels on the
+# longest side; encodings are still taken from the full-resolution image
+DETECT_MAX_DIMENSION = 640
+
+# Optional YuNet face detector (OpenCV DNN, face_detection_yunet_2023mar.onnx
+# from the opencv_zoo repository). Used instead of the Haar cascade when this
+# file exists. Its face boxes differ from the cascade's, so re-register users
+# after switching detectors.
+YUNET_MODEL_PATH = os.path.join(DATA_DIR, "face_detection_yunet_2023mar.onnx")
+YUNET_SCORE_THRESHOLD = 0.6
+
+# Most face detectors loaded per process; each is used by one thread at a
+# time, so match this to the request threads (e.g. gunicorn --threads)
+DETECTOR_POOL_SIZE = 8
+
+# Run the Haar cascade through OpenCV's OpenCL backend (e.g. on an integrated
+# GPU) when one is available. Off by default: on machines without a GPU the
+# OpenCL CPU device is usually slower than the plain CPU path.
+DETECT_USE_OPENCL = False
+
+# CLI camera frames are scaled by this factor for face detection
+# (0.5 = a quarter of the pixels); encodings still use the full frame
+DETECT_DOWNSCALE = 0.5
+
+# Match against int8-quantized encodings (4x less memory per scan, tiny
+# distance error). Off by default so distances stay exact.
+FACE_MATCH_QUANTIZED = False
+
+# With faiss-cpu installed, search an approximate (HNSW) FAISS index instead
+# of scanning every encoding once this many users are registered
+FAISS_MIN_USERS = 10000
+
+# Stacked face encodings are cached in each process and checked against a
+# cheap version stamp of the users table on every lookup; they are also
+# reloaded after at most this many seconds regardless
+FACE_CACHE_TTL = 60
+
 # Registration Settings
 REGISTRATION_FRAMES = 5  # Number of frames to capture for registration
 REGISTRATION_DELAY = 0.5  # Seconds between frame captures
+# Once a face is found, look for it only in this margin (fraction of the face
+# size) around its last position, with a full-frame detection every
+# REGISTRATION_FULL_DETECT_EVERY frames to notice anyone else stepping in
+REGISTRATION_TRACK_MARGIN = 0.5
+REGISTRATION_FULL_DETECT_EVERY = 10
 
 # =============================================================================
 # Liveness Detection Settings
@@ -67,12 +133,26 @@ HEAD_MOVEMENT_TIMEOUT = 15  # Seconds to complete head movement
 # Liveness challenge modes: "blink", "head", "random", "both"
 LIVENESS_CHALLENGE_MODE = "random"
 
+# Liveness checks keep only the most recent frames, as small thumbnails
+LIVENESS_FRAME_HISTORY = 16
+LIVENESS_THUMBNAIL_SIZE = (160, 120)
+
+# Head movement check runs face detection on every Nth frame only (and on
+# every frame while the face is lost), reusing the last position in between
+LIVENESS_DETECT_EVERY = 2
+
 # =============================================================================
 # Camera Settings
 # =============================================================================
 CAMERA_INDEX = 0  # Default camera
 FRAME_WIDTH = 640
 FRAME_HEIGHT = 480
+# Frames the capture driver may queue; 1 makes each read return the newest
+# frame. Not every backend supports it. 0 = keep the driver default.
+CAMERA_BUFFERSIZE = 1
+# Seconds to let a freshly opened camera adjust exposure before a single-frame
+# capture (login/verify without liveness)
+CAMERA_WARMUP = 1.0
 
 # =============================================================================
 # Display Settings
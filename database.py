@@ -5,9 +5,20 @@ Provides both MySQL (via SQLAlchemy) and JSON storage options
 
 import os
 import json
+import time
+import threading
 import numpy as np
 from datetime import datetime
-from config import DATA_DIR, USERS_FILE
+from config import DATA_DIR, USERS_FILE, LEGACY_USERS_FILE, FACE_CACHE_TTL, FACE_MATCH_QUANTIZED
+
+# In-process cache of the face encodings used for face login: an EncodingStore
+# kept up to date on register/delete, the matching data derived from it, and
+# the version stamp (see _face_cache_version) of the rows it reflects
+_face_cache = {'store': None, 'data': None, 'loaded_at': 0.0, 'version': None}
+_face_cache_lock = threading.RLock()
+
+# Loaded users.npz, reused until the file changes (see load_users)
+_users_cache = {'key': None, 'users': {}, 'lower': {}, 'matrix': None}
 
 # =============================================================================
 # SQLAlchemy Database Operations (MySQL)
@@ -19,6 +30,50 @@ def get_db_session():
     return db.session
 
 
+def invalidate_face_cache():
+    """Drop cached face encodings so the next lookup reloads them."""
+    with _face_cache_lock:
+        _face_cache['store'] = None
+        _face_cache['data'] = None
+
+
+def _face_cache_version():
+    """
+    Cheap stamp of the active users with faces: (count, max id, max updated_at).
+    
+    Registering, deleting, (de)activating or re-encoding a user changes it, so
+    every process notices another process's writes on its next lookup.
+    Logins leave it alone (see User.mark_login).
+    """
+    from models import User, db
+    from sqlalchemy import func
+    
+    return tuple(db.session.query(
+        func.count(User.id), func.max(User.id), func.max(User.updated_at)
+    ).filter(
+        User.face_encoding.isnot(None),
+        User.is_active == True
+    ).one())
+
+
+def _cache_face_encoding(username, encoding):
+    """Add or replace one user's (committed) encoding in the loaded face cache."""
+    with _face_cache_lock:
+        if _face_cache['store'] is not None:
+            _face_cache['store'].add(username, encoding)
+            _face_cache['data'] = None
+            _face_cache['version'] = _face_cache_version()
+
+
+def uncache_face_encoding(username):
+    """Remove one user's encoding from the loaded face cache (after commit)."""
+    with _face_cache_lock:
+        if _face_cache['store'] is not None:
+            _face_cache['store'].remove(username)
+            _face_cache['data'] = None
+            _face_cache['version'] = _face_cache_version()
+
+
 def save_user_to_db(username, email, password=None, role='user', encoding=None):
     """
     Save a new user to MySQL database.
@@ -54,6 +109,9 @@ def save_user_to_db(username, email, password=None, role='user', encoding=None):
     db.session.add(user)
     db.session.commit()
     
+    if encoding is not None:
+        _cache_face_encoding(username, encoding)
+    
     return user
 
 
@@ -69,24 +127,64 @@ def update_user_face_encoding(user_id, encoding):
     user.updated_at = datetime.utcnow()
     db.session.commit()
     
+    if user.is_active:
+        _cache_face_encoding(user.username, encoding)
+    
     return True
 
 
 def get_all_users_with_faces():
     """
-    Get all users with face encodings.
+    Get all active users with face encodings, stacked for matching.
+    
+    The encodings are cached per process in an EncodingStore that is updated
+    in place as faces are registered or removed in this process. Each lookup
+    checks the users table's version stamp, so changes made by other
+    processes (e.g. other gunicorn workers) trigger a reload; so do
+    invalidate_face_cache() and FACE_CACHE_TTL passing, as a backstop.
     
     Returns:
-        Dictionary of {username: encoding_array}
+        StackedEncodings of (usernames, float32 matrix of shape (N, D), sq_norms),
+        or QuantizedEncodings when FACE_MATCH_QUANTIZED is enabled
     """
-    from models import User
+    with _face_cache_lock:
+        store = _face_cache['store']
+        version = _face_cache_version()
+        if (store is None or version != _face_cache['version']
+                or time.monotonic() - _face_cache['loaded_at'] >= FACE_CACHE_TTL):
+            store = _load_face_store()
+            _face_cache['store'] = store
+            _face_cache['data'] = None
+            _face_cache['loaded_at'] = time.monotonic()
+            _face_cache['version'] = version
+        
+        data = _face_cache['data']
+        if data is None:
+            data = store.quantized() if FACE_MATCH_QUANTIZED else store.stacked()
+            _face_cache['data'] = data
+        return data
+
+
+def _load_face_store():
+    """Read every active user's face encoding into an EncodingStore."""
+    from models import User, db
+    from face_utils import ENCODING_DIM, EncodingStore
     
-    users = User.query.filter(
+    # Only fetch the two columns needed, not full User objects
+    rows = db.session.query(User.username, User.face_encoding).filter(
         User.face_encoding.isnot(None),
         User.is_active == True
     ).all()
     
-    return {user.username: user.get_face_encoding() for user in users}
+    # Copy the raw float32 blobs straight into one (N, D) matrix
+    blob_size = ENCODING_DIM * 4
+    rows = [(username, blob) for username, blob in rows if len(blob) == blob_size]
+    usernames = [username for username, _ in rows]
+    matrix = np.frombuffer(
+        b''.join(blob for _, blob in rows), dtype='<f4'
+    ).reshape(-1, ENCODING_DIM)
+    
+    return EncodingStore.from_matrix(usernames, matrix, quantized=FACE_MATCH_QUANTIZED)
 
 
 def get_user_by_username(username):
@@ -107,6 +205,35 @@ def get_users_by_role(role):
     return User.query.filter_by(role=role, is_active=True).all()
 
 
+def get_user_rows(role=None):
+    """
+    Get users as plain dicts with the same keys as User.to_dict().
+    
+    Selects only the listed columns, so face encodings and password hashes
+    are never read. Datetimes are left as datetime objects for the JSON encoder.
+    
+    Args:
+        role: Optional filter by role
+    
+    Returns:
+        List of dicts
+    """
+    from models import User, db
+    from sqlalchemy import select
+    
+    query = select(
+        User.id, User.username, User.email, User.role, User.is_active,
+        User.face_encoding.isnot(None).label('has_face'),
+        User.password_hash.isnot(None).label('has_password'),
+        User.created_at, User.last_login
+    )
+    
+    if role:
+        query = query.where(User.role == role)
+    
+    return [dict(row._mapping) for row in db.session.execute(query)]
+
+
 def delete_user_from_db(user_id):
     """Delete user from database."""
     from models import User, db
@@ -117,11 +244,13 @@ def delete_user_from_db(user_id):
     
     db.session.delete(user)
     db.session.commit()
+    invalidate_face_cache()
     return True
 
 
 def log_attendance(user_id, login_method='face', liveness_score=None, 
-                   face_confidence=None, ip_address=None, user_agent=None):
+                   face_confidence=None, ip_address=None, user_agent=None,
+                   commit=True):
     """
     Create an attendance log entry for login.
     
@@ -132,6 +261,8 @@ def log_attendance(user_id, login_method='face', liveness_score=None,
         face_confidence: Face match confidence (0-100)
         ip_address: Client IP address
         user_agent: Browser user agent
+        commit: Commit now; pass False to only flush (assigning the id) and
+            let the caller commit it together with its other changes
     
     Returns:
         AttendanceLog object
@@ -149,7 +280,10 @@ def log_attendance(user_id, login_method='face', liveness_score=None,
     )
     
     db.session.add(log)
-    db.session.commit()
+    if commit:
+        db.session.commit()
+    else:
+        db.session.flush()
     
     return log
 
@@ -208,8 +342,63 @@ def get_attendance_logs(user_id=None, start_date=None, end_date=None, limit=100)
     return query.order_by(AttendanceLog.login_time.desc()).limit(limit).all()
 
 
+def get_attendance_rows(user_id=None, start_date=None, end_date=None, limit=100):
+    """
+    Get attendance logs as plain dicts, read with a single Core query.
+    
+    Same filters and keys as get_attendance_logs() + AttendanceLog.to_dict(),
+    but the username comes from a join instead of one lazy load per row.
+    Datetimes are left as datetime objects for the JSON encoder.
+    
+    Returns:
+        List of dicts
+    """
+    from models import AttendanceLog, User, db
+    from sqlalchemy import select
+    
+    query = select(
+        AttendanceLog.id, AttendanceLog.user_id, User.username,
+        AttendanceLog.login_time, AttendanceLog.logout_time,
+        AttendanceLog.login_method, AttendanceLog.liveness_score,
+        AttendanceLog.face_confidence, AttendanceLog.is_active
+    ).outerjoin(User, AttendanceLog.user_id == User.id)
+    
+    if user_id:
+        query = query.where(AttendanceLog.user_id == user_id)
+    
+    if start_date:
+        query = query.where(AttendanceLog.login_time >= start_date)
+    
+    if end_date:
+        query = query.where(AttendanceLog.login_time <= end_date)
+    
+    query = query.order_by(AttendanceLog.login_time.desc())
+    if limit is not None:
+        query = query.limit(limit)
+    
+    logs = []
+    for row in db.session.execute(query):
+        duration = None
+        if row.logout_time:
+            duration = (row.logout_time - row.login_time).total_seconds() / 60
+        logs.append({
+            'id': row.id,
+            'user_id': row.user_id,
+            'username': row.username,
+            'login_time': row.login_time,
+            'logout_time': row.logout_time,
+            'duration_minutes': duration,
+            'login_method': row.login_method,
+            'liveness_score': row.liveness_score,
+            'face_confidence': row.face_confidence,
+            'is_active': row.is_active
+        })
+    return logs
+
+
 def log_login_attempt(user_id=None, attempt_type='face', success=False,
-                      failure_reason=None, ip_address=None, user_agent=None):
+                      failure_reason=None, ip_address=None, user_agent=None,
+                      commit=True):
     """
     Log a login attempt for security monitoring.
     
@@ -220,6 +409,7 @@ def log_login_attempt(user_id=None, attempt_type='face', success=False,
         failure_reason: Reason for failure if applicable
         ip_address: Client IP address
         user_agent: Browser user agent
+        commit: Commit now; pass False to leave it to the caller
     
     Returns:
         LoginAttempt object
@@ -236,7 +426,8 @@ def log_login_attempt(user_id=None, attempt_type='face', success=False,
     )
     
     db.session.add(attempt)
-    db.session.commit()
+    if commit:
+        db.session.commit()
     
     return attempt
 
@@ -256,8 +447,31 @@ def get_login_attempts(user_id=None, success=None, limit=100):
     return query.order_by(LoginAttempt.timestamp.desc()).limit(limit).all()
 
 
+def get_login_attempt_rows(user_id=None, success=None, limit=100):
+    """Get login attempts as plain dicts (see get_attendance_rows)."""
+    from models import LoginAttempt, User, db
+    from sqlalchemy import select
+    
+    query = select(
+        LoginAttempt.id, LoginAttempt.user_id, User.username,
+        LoginAttempt.timestamp, LoginAttempt.attempt_type,
+        LoginAttempt.success, LoginAttempt.failure_reason,
+        LoginAttempt.ip_address
+    ).outerjoin(User, LoginAttempt.user_id == User.id)
+    
+    if user_id:
+        query = query.where(LoginAttempt.user_id == user_id)
+    
+    if success is not None:
+        query = query.where(LoginAttempt.success == success)
+    
+    query = query.order_by(LoginAttempt.timestamp.desc()).limit(limit)
+    
+    return [dict(row._mapping) for row in db.session.execute(query)]
+
+
 # =============================================================================
-# JSON File Storage (Legacy - for CLI mode)
+# Local File Storage (Legacy - for CLI mode)
 # =============================================================================
 
 def ensure_data_dir():
@@ -266,52 +480,165 @@ def ensure_data_dir():
         os.makedirs(DATA_DIR)
 
 
-def load_users():
+def _set_users_cache(key, users):
+    """Replace the cached users dict (and derived data) for file version key."""
+    from face_utils import ENCODING_DIM, index_encodings
+    
+    _users_cache['key'] = key
+    _users_cache['users'] = users
+    _users_cache['lower'] = {username.lower(): username for username in users}
+    
+    # Only rows of the current encoding width can be matched. np.stack always
+    # copies, so the matrix never shares memory with the arrays in users
+    usernames = [u for u, encoding in users.items() if len(encoding) == ENCODING_DIM]
+    if usernames:
+        matrix = np.ascontiguousarray(np.stack([users[u] for u in usernames]), dtype=np.float32)
+    else:
+        matrix = np.empty((0, ENCODING_DIM), dtype=np.float32)
+    _users_cache['matrix'] = index_encodings(usernames, matrix)
+
+
+def _read_users_store():
     """
-    Load all registered users from JSON file.
+    Read users.npz into a dict of {username: float32 encoding}.
     
-    Returns:
-        Dictionary of {username: encoding_list}
+    Encodings are stored as one matrix per encoding length (usernames_<D> and
+    encodings_<D>), so rows left over from an older encoder are kept too.
     """
+    users = {}
+    with np.load(USERS_FILE) as data:
+        for key in data.files:
+            if not key.startswith('encodings_'):
+                continue
+            matrix = data[key].astype(np.float32)
+            usernames = data['usernames_' + key[len('encodings_'):]].tolist()
+            users.update(zip(usernames, matrix))
+    return users
+
+
+def _migrate_legacy_users():
+    """Convert users.json from older versions into users.npz."""
+    try:
+        with open(LEGACY_USERS_FILE, 'r') as f:
+            data = json.load(f)
+    except (json.JSONDecodeError, IOError):
+        return
+    
+    save_users(data)
+    print(f"[OK] Converted {len(data)} user(s) from {LEGACY_USERS_FILE} to {USERS_FILE}")
+
+
+def _refresh_users_cache():
+    """Re-read users.npz only if its mtime or size changed since the last read."""
     ensure_data_dir()
     
-    if not os.path.exists(USERS_FILE):
-        return {}
+    if not os.path.exists(USERS_FILE) and os.path.exists(LEGACY_USERS_FILE):
+        _migrate_legacy_users()
     
     try:
-        with open(USERS_FILE, 'r') as f:
-            data = json.load(f)
-        
-        # Convert lists back to numpy arrays for face comparison
-        return {username: np.array(encoding) for username, encoding in data.items()}
-    except (json.JSONDecodeError, IOError):
-        return {}
+        st = os.stat(USERS_FILE)
+    except OSError:
+        _set_users_cache(None, {})
+        return
+    
+    key = (st.st_mtime_ns, st.st_size)
+    if key == _users_cache['key']:
+        return
+    
+    try:
+        _set_users_cache(key, _read_users_store())
+    except (OSError, KeyError, ValueError):
+        _set_users_cache(None, {})
+
+
+def load_users():
+    """
+    Load all registered users from the encoding store.
+    
+    The file is cached and only re-read after it changes on disk.
+    
+    Returns:
+        Dictionary of {username: float32 encoding array}
+    """
+    _refresh_users_cache()
+    # Copy so callers can modify it without touching the cache
+    return dict(_users_cache['users'])
+
+
+def load_user_matrix():
+    """
+    Load registered users stacked for vectorized matching.
+    
+    Returns:
+        StackedEncodings of (usernames, float32 matrix of shape (N, D), sq_norms)
+    """
+    _refresh_users_cache()
+    return _users_cache['matrix']
+
+
+def find_username(username):
+    """
+    Find a registered username, ignoring case.
+    
+    Returns:
+        The username as stored, or None if not registered
+    """
+    _refresh_users_cache()
+    return _users_cache['lower'].get(username.lower())
+
+
+def get_user_encoding(username):
+    """
+    Get one user's face encoding without copying the whole store.
+    
+    Unlike find_username(), the name must match exactly (including case),
+    since this is used to verify an identity.
+    
+    Returns:
+        float32 encoding array, or None if the user is not registered
+    """
+    _refresh_users_cache()
+    return _users_cache['users'].get(username)
 
 
 def save_users(users_dict):
     """
-    Save users dictionary to JSON file.
+    Save users dictionary to the encoding store.
     
     Args:
         users_dict: Dictionary of {username: encoding}
     """
     ensure_data_dir()
     
-    # Convert numpy arrays to lists for JSON serialization
-    serializable = {}
-    for username, encoding in users_dict.items():
-        if isinstance(encoding, np.ndarray):
-            serializable[username] = encoding.tolist()
-        else:
-            serializable[username] = encoding
+    users = {
+        username: np.asarray(encoding, dtype=np.float32).ravel()
+        for username, encoding in users_dict.items()
+    }
+    
+    # One (usernames, matrix) pair per encoding length
+    groups = {}
+    for username, encoding in users.items():
+        groups.setdefault(len(encoding), []).append(username)
+    
+    arrays = {}
+    for dim, usernames in groups.items():
+        arrays[f'usernames_{dim}'] = np.array(usernames, dtype=str)
+        arrays[f'encodings_{dim}'] = np.stack([users[u] for u in usernames])
+    
+    # Write to a temp file and swap it in so readers never see a partial store
+    tmp_path = USERS_FILE + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, USERS_FILE)
     
-    with open(USERS_FILE, 'w') as f:
-        json.dump(serializable, f, indent=2)
+    # Cache what was just written instead of reading it back on the next load
+    st = os.stat(USERS_FILE)
+    _set_users_cache((st.st_mtime_ns, st.st_size), users)
 
 
 def save_user(username, encoding):
     """
-    Save a single user to JSON file.
+    Save a single user to the user store.
     
     Args:
         username: User's name/identifier
@@ -320,15 +647,11 @@ def save_user(username, encoding):
     Returns:
         True if saved successfully, False if user already exists
     """
-    users = load_users()
-    
-    if username.lower() in [u.lower() for u in users.keys()]:
+    if find_username(username) is not None:
         return False
     
-    if isinstance(encoding, np.ndarray):
-        users[username] = encoding.tolist()
-    else:
-        users[username] = encoding
+    users = load_users()
+    users[username] = encoding
     
     save_users(users)
     return True
@@ -336,7 +659,7 @@ def save_user(username, encoding):
 
 def update_user(username, encoding):
     """
-    Update an existing user's encoding in JSON file.
+    Update an existing user's encoding in the user store.
     
     Args:
         username: User's name
@@ -345,15 +668,13 @@ def update_user(username, encoding):
     Returns:
         True if updated, False if user doesn't exist
     """
-    users = load_users()
+    found_key = find_username(username)
     
-    if username not in users:
+    if found_key is None:
         return False
     
-    if isinstance(encoding, np.ndarray):
-        users[username] = encoding.tolist()
-    else:
-        users[username] = encoding
+    users = load_users()
+    users[found_key] = encoding
     
     save_users(users)
     return True
@@ -361,7 +682,7 @@ def update_user(username, encoding):
 
 def delete_user(username):
     """
-    Delete a user from JSON file.
+    Delete a user from the user store.
     
     Args:
         username: User to delete
@@ -369,18 +690,13 @@ def delete_user(username):
     Returns:
         True if deleted, False if user not found
     """
-    users = load_users()
-    
     # Case-insensitive search
-    found_key = None
-    for key in users.keys():
-        if key.lower() == username.lower():
-            found_key = key
-            break
+    found_key = find_username(username)
     
     if found_key is None:
         return False
     
+    users = load_users()
     del users[found_key]
     save_users(users)
     return True
@@ -388,7 +704,7 @@ def delete_user(username):
 
 def user_exists(username):
     """
-    Check if a user is registered in JSON file.
+    Check if a user is registered in the user store.
     
     Args:
         username: User to check
@@ -396,15 +712,16 @@ def user_exists(username):
     Returns:
         Boolean indicating if user exists
     """
-    users = load_users()
-    return username.lower() in [u.lower() for u in users.keys()]
+    return find_username(username) is not None
 
 
 def get_user_count():
-    """Get total number of registered users from JSON file."""
-    return len(load_users())
+    """Get total number of registered users from the user store."""
+    _refresh_users_cache()
+    return len(_users_cache['users'])
 
 
 def list_users():
-    """Get list of all registered usernames from JSON file."""
-    return list(load_users().keys())
+    """Get list of all registered usernames from the user store."""
+    _refresh_users_cache()
+    return list(_users_cache['users'].keys())
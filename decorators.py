@@ -3,11 +3,18 @@ Flask Route Decorators for Role-Based Access Control
 """
 
 from functools import wraps
-from flask import jsonify
+from flask import jsonify, g
 from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
 from models import User
 
 
+def _load_user(user_id):
+    """Load the JWT user once per request, caching it on flask.g."""
+    if 'current_user' not in g:
+        g.current_user = User.query.get(int(user_id)) if user_id is not None else None
+    return g.current_user
+
+
 def login_required(f):
     """Decorator to require authenticated user."""
     @wraps(f)
@@ -30,8 +37,7 @@ def admin_required(f):
     def decorated_function(*args, **kwargs):
         try:
             verify_jwt_in_request()
-            user_id = get_jwt_identity()
-            user = User.query.get(int(user_id))
+            user = _load_user(get_jwt_identity())
             
             if not user:
                 return jsonify({
@@ -62,8 +68,7 @@ def role_required(*roles):
         def decorated_function(*args, **kwargs):
             try:
                 verify_jwt_in_request()
-                user_id = get_jwt_identity()
-                user = User.query.get(int(user_id))
+                user = _load_user(get_jwt_identity())
                 
                 if not user:
                     return jsonify({
@@ -91,12 +96,12 @@ def role_required(*roles):
 def get_current_user():
     """Get current authenticated user from JWT."""
     try:
+        # Already loaded by a decorator (or an earlier call) in this request
+        if 'current_user' in g:
+            return g.current_user
+        
         verify_jwt_in_request()
-        user_id = get_jwt_identity()
-        # Ensure user_id is an integer
-        if user_id is not None:
-            return User.query.get(int(user_id))
-        return None
+        return _load_user(get_jwt_identity())
     except Exception as e:
         print(f"get_current_user error: {e}")
         return None
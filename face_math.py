@@ -0,0 +1,240 @@
+"""
+Face Matching Math
+Distance kernels behind face_utils.find_best_match, JIT-compiled with Numba when available
+(or built ahead of time with build_face_math.py)
+"""
+
+import numpy as np
+from config import FACE_SIZE, FAISS_MIN_USERS
+
+# Length of the encodings produced by face_utils.encode_face()
+ENCODING_DIM = FACE_SIZE[0] * FACE_SIZE[1]
+
+# Dimensions summed between early-exit checks in the Numba scan, and the
+# fraction (1/N) of rows that may survive the first block before the scan
+# gives up on pruning
+PRUNE_BLOCK = 256
+PRUNE_MAX_SURVIVORS = 4
+
+# Below this many rows the Numba scan's second pass runs on one thread;
+# above it, in chunks of about PARALLEL_CHUNK_ROWS rows
+PARALLEL_MIN_ROWS = 2048
+PARALLEL_CHUNK_ROWS = 1024
+
+# Kernels compiled ahead of time by build_face_math.py; with them Numba is
+# not imported at all, so there is no JIT or cache-loading cost at startup
+try:
+    import face_math_aot
+except ImportError:
+    face_math_aot = None
+
+# Numba is optional - fall back to NumPy when it is not installed
+NUMBA_AVAILABLE = False
+if face_math_aot is None:
+    try:
+        from numba import njit, prange
+        NUMBA_AVAILABLE = True
+    except ImportError:
+        pass
+
+# FAISS is optional - only used once there are FAISS_MIN_USERS encodings
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+
+def quantize(matrix):
+    """Symmetric per-row int8 quantization of a 2D float array."""
+    scales = (np.abs(matrix).max(axis=1) / 127.0).astype(np.float32)
+    scales[scales == 0] = 1.0
+    codes = np.round(matrix / scales[:, None]).astype(np.int8)
+    return np.ascontiguousarray(codes), scales
+
+
+if NUMBA_AVAILABLE:
+    @njit('f4(f4[::1], f4[::1], i8, i8)', fastmath=True, cache=True, inline='always')
+    def _sq_dist_span(a, b, start, stop):
+        """Squared distance of a[start:stop] and b[start:stop]."""
+        total = np.float32(0.0)
+        for j in range(start, stop):
+            d = a[j] - b[j]
+            total += d * d
+        return total
+    
+    @njit('Tuple((i8, f4))(f4[:, ::1], f4[::1])', parallel=True, fastmath=True, cache=True)
+    def _batch_sqeuclid_numba(matrix, query):
+        """Return (index, squared distance) of the closest row in matrix to query.
+        
+        Rows are summed PRUNE_BLOCK dimensions at a time and dropped as soon
+        as their partial sum reaches the best distance found so far. The
+        first block of every row is summed up front and the most promising
+        row is finished first, so the bound is tight from the start and most
+        rows are never read past their first block. The result is exact.
+        
+        Returns index -1 when the first blocks rule out too few rows.
+        """
+        n, dim = matrix.shape
+        head = min(dim, PRUNE_BLOCK)
+        
+        partial = np.empty(n, dtype=np.float32)
+        for i in prange(n):
+            partial[i] = _sq_dist_span(matrix[i], query, 0, head)
+        
+        best_index = 0
+        for i in range(1, n):
+            if partial[i] < partial[best_index]:
+                best_index = i
+        best = partial[best_index] + _sq_dist_span(matrix[best_index], query, head, dim)
+        
+        # Query far from everything (e.g. an unknown face): too few rows can
+        # be ruled out for pruning to pay off, so leave it to the full scan
+        survivors = 0
+        for i in range(n):
+            if partial[i] < best:
+                survivors += 1
+        if survivors > n // PRUNE_MAX_SURVIVORS:
+            return -1, best
+        
+        # Finish the remaining rows in parallel chunks for large N, each
+        # pruning against its own running best, then take the best chunk
+        n_chunks = 1
+        if n >= PARALLEL_MIN_ROWS:
+            n_chunks = n // PARALLEL_CHUNK_ROWS
+        chunk_best = np.full(n_chunks, best, dtype=np.float32)
+        chunk_index = np.full(n_chunks, best_index, dtype=np.int64)
+        
+        for c in prange(n_chunks):
+            local_best = best
+            local_index = best_index
+            for i in range(c * n // n_chunks, (c + 1) * n // n_chunks):
+                total = partial[i]
+                if total >= local_best or i == best_index:
+                    continue
+                for start in range(head, dim, PRUNE_BLOCK):
+                    total += _sq_dist_span(matrix[i], query, start, min(start + PRUNE_BLOCK, dim))
+                    if total >= local_best:
+                        break
+                if total < local_best:
+                    local_best = total
+                    local_index = i
+            chunk_best[c] = local_best
+            chunk_index[c] = local_index
+        
+        c = np.argmin(chunk_best)
+        return chunk_index[c], chunk_best[c]
+    
+    @njit('f4[::1](i1[::1], f4, f4, i1[:, ::1], f4[::1], f4[::1])',
+          parallel=True, fastmath=True, cache=True)
+    def _quantized_sq_distances_numba(query_codes, query_scale, query_sq_norm,
+                                      codes, scales, sq_norms):
+        """Squared distance of every quantized row to a quantized query."""
+        n, dim = codes.shape
+        distances = np.empty(n, dtype=np.float32)
+        
+        for i in prange(n):
+            dot = 0
+            for j in range(dim):
+                dot += np.int32(codes[i, j]) * np.int32(query_codes[j])
+            distances[i] = sq_norms[i] + query_sq_norm - 2.0 * scales[i] * query_scale * dot
+        
+        return distances
+
+
+if face_math_aot is not None:
+    _batch_sqeuclid_kernel = face_math_aot.batch_sqeuclid
+    _quantized_sq_distances_kernel = face_math_aot.quantized_sq_distances
+elif NUMBA_AVAILABLE:
+    _batch_sqeuclid_kernel = _batch_sqeuclid_numba
+    _quantized_sq_distances_kernel = _quantized_sq_distances_numba
+else:
+    _batch_sqeuclid_kernel = _quantized_sq_distances_kernel = None
+
+
+def batch_sqeuclid(matrix, query, sq_norms=None):
+    """
+    Find the row of matrix closest to query.
+    
+    Args:
+        matrix: float32 ndarray of shape (N, D), N > 0
+        query: float32 ndarray of shape (D,)
+        sq_norms: Optional precomputed squared norms of the matrix rows
+    
+    Returns:
+        Tuple of (index: int, squared euclidean distance: float)
+    """
+    if _batch_sqeuclid_kernel is not None:
+        # The early-exit scan usually reads only a fraction of each row, which
+        # beats the full matrix-vector product below even with the norms known
+        best_index, best_sq_dist = _batch_sqeuclid_kernel(
+            np.ascontiguousarray(matrix, dtype=np.float32),
+            np.ascontiguousarray(query, dtype=np.float32)
+        )
+        if best_index >= 0:
+            return int(best_index), float(best_sq_dist)
+    
+    if sq_norms is None:
+        sq_norms = np.einsum('ij,ij->i', matrix, matrix)
+    
+    # ||a - b||^2 = ||a||^2 + ||b||^2 - 2ab: one BLAS matrix-vector product
+    # and no (N, D) temporary
+    distances = sq_norms + query @ query - 2.0 * (matrix @ query)
+    best_index = int(distances.argmin())
+    return best_index, max(float(distances[best_index]), 0.0)
+
+
+def quantized_sq_distances(query, codes, scales, sq_norms):
+    """
+    Squared distance of query to every int8-quantized row.
+    
+    Uses ||a||^2 + ||b||^2 - 2ab with the dot product taken on the int8 codes.
+    
+    Args:
+        query: float32 ndarray of shape (D,)
+        codes, scales: Output of quantize() for the stored matrix
+        sq_norms: Squared norms of the unquantized stored rows
+    
+    Returns:
+        float32 ndarray of shape (N,)
+    """
+    query_codes, query_scale = quantize(query[None, :])
+    query_codes, query_scale = query_codes[0], query_scale[0]
+    query_sq_norm = np.float32(query @ query)
+    
+    if _quantized_sq_distances_kernel is not None:
+        return _quantized_sq_distances_kernel(query_codes, query_scale, query_sq_norm,
+                                               codes, scales, sq_norms)
+    
+    dots = np.einsum('ij,j->i', codes, query_codes, dtype=np.int32)
+    return sq_norms + query_sq_norm - 2.0 * scales * query_scale * dots
+
+
+def build_search_index(matrix):
+    """
+    Build an approximate (HNSW) FAISS index over the rows of matrix.
+    
+    Only worth it for large user counts: below FAISS_MIN_USERS the exact
+    matrix-vector scan in batch_sqeuclid is faster (so is it than an exact
+    faiss.IndexFlatL2 at these dimensions).
+    
+    Returns:
+        FAISS index, or None when FAISS is not installed or matrix is small
+    """
+    if faiss is None or len(matrix) < FAISS_MIN_USERS:
+        return None
+    
+    index = faiss.IndexHNSWFlat(matrix.shape[1], 32)
+    index.hnsw.efSearch = 64  # Wider search than the default 16 for better recall
+    index.add(np.ascontiguousarray(matrix, dtype=np.float32))
+    return index
+
+
+def search_index(index, query):
+    """
+    Find the closest indexed row to query.
+    
+    Returns:
+        Tuple of (index: int, squared euclidean distance: float)
+    """
+    distances, indices = index.search(np.ascontiguousarray(query[None, :], dtype=np.float32), 1)
+    return int(indices[0, 0]), max(float(distances[0, 0]), 0.0)
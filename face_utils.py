@@ -6,13 +6,51 @@ Core functions for face recognition operations using pure OpenCV (No dlib/face_r
 import cv2
 import numpy as np
 import os
+import hashlib
+import multiprocessing
+import queue
+import threading
+import time
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from face_math import (
+    ENCODING_DIM, quantize, batch_sqeuclid, quantized_sq_distances,
+    build_search_index, search_index
+)
 from config import (
     FACE_MATCH_TOLERANCE,
+    FACE_SIZE,
     CAMERA_INDEX,
     FRAME_WIDTH,
     FRAME_HEIGHT,
+    CAMERA_BUFFERSIZE,
+    DETECT_MAX_DIMENSION,
+    DETECT_DOWNSCALE,
+    YUNET_MODEL_PATH,
+    YUNET_SCORE_THRESHOLD,
+    DETECTOR_POOL_SIZE,
+    DETECT_USE_OPENCL,
+    REGISTRATION_TRACK_MARGIN,
+    REGISTRATION_FULL_DETECT_EVERY,
+    IMAGE_DECODE_REDUCTION,
+    FACE_WORKER_PROCESSES,
+    ANALYZE_CACHE_SIZE,
 )
 
+# pybase64 (SIMD-accelerated) is optional - fall back to the stdlib decoder
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+# PyTurboJPEG is optional - JPEG uploads fall back to cv2.imdecode without it
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+    turbo_jpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    turbo_jpeg = None
+
 # Load Haar Cascade for face detection
 # Try to load from cv2 data, fallback to local file if needed
 CASCADE_PATH = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
@@ -20,7 +58,60 @@ if not os.path.exists(CASCADE_PATH):
     # Fallback to looking in local directory or common paths if cv2 data is missing
     CASCADE_PATH = 'haarcascade_frontalface_default.xml'
 
-face_cascade = cv2.CascadeClassifier(CASCADE_PATH)
+# The YuNet DNN detector is faster and more accurate, but needs its model file
+USE_YUNET = hasattr(cv2, 'FaceDetectorYN') and os.path.exists(YUNET_MODEL_PATH)
+
+
+def create_detector():
+    """Create a face detector: YuNet if its model is available, else the Haar cascade."""
+    if USE_YUNET:
+        return cv2.FaceDetectorYN.create(
+            YUNET_MODEL_PATH, '', (FRAME_WIDTH, FRAME_HEIGHT),
+            score_threshold=YUNET_SCORE_THRESHOLD
+        )
+    return cv2.CascadeClassifier(CASCADE_PATH)
+
+
+# Loaded once per process at import (under gunicorn --preload, workers are
+# forked with it already loaded) and the first detector in the pool below
+face_cascade = create_detector()
+if not USE_YUNET and face_cascade.empty():
+    print(f"Warning: could not load face cascade from {CASCADE_PATH}")
+
+# Haar detection on cv2.UMat images, which OpenCV runs through OpenCL
+USE_OPENCL = DETECT_USE_OPENCL and not USE_YUNET and cv2.ocl.haveOpenCL()
+if USE_OPENCL:
+    cv2.ocl.setUseOpenCL(True)
+
+# Detectors not currently in use (see checkout_detector), most recently
+# returned first so the warm ones are reused
+_detector_pool = queue.LifoQueue()
+_detector_pool.put(face_cascade)
+_detectors_created = 1
+_detector_pool_lock = threading.Lock()
+
+# cv2.imdecode flag for the configured decode-time downscale
+IMDECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+IMDECODE_FLAG = IMDECODE_FLAGS.get(IMAGE_DECODE_REDUCTION, cv2.IMREAD_COLOR)
+
+# Same downscale expressed as a TurboJPEG scaling factor
+TURBO_JPEG_SCALE = (1, IMAGE_DECODE_REDUCTION) if IMDECODE_FLAG != cv2.IMREAD_COLOR else None
+
+JPEG_MAGIC = b'\xff\xd8\xff'
+
+# Process pool for face processing, created on first use
+_face_pool = None
+_face_pool_lock = threading.Lock()
+
+# Recent analyze_face_image() results, least recently used first
+_analyze_cache = OrderedDict()
+_analyze_cache_lock = threading.Lock()
+
 
 def get_camera():
     """Initialize and return camera capture object."""
@@ -31,6 +122,10 @@ def get_camera():
     if not cap.isOpened():
         raise RuntimeError("Could not open camera. Please check if webcam is connected.")
     
+    if CAMERA_BUFFERSIZE and not cap.set(cv2.CAP_PROP_BUFFERSIZE, CAMERA_BUFFERSIZE):
+        # Stale frames are still skipped by read_fresh_frame and FrameGrabber
+        print("Warning: camera backend ignored CAP_PROP_BUFFERSIZE; frames may lag")
+    
     return cap
 
 
@@ -42,21 +137,189 @@ def capture_frame(cap):
     return frame
 
 
-def detect_faces(image, model="hog"):
+def read_fresh_frame(cap, discard=4, warmup=0.0):
+    """
+    Read a current frame, skipping frames already waiting in the camera buffer.
+    
+    grab() does not decode, so dropping the stale frames is cheap.
+    
+    Args:
+        cap: OpenCV VideoCapture
+        discard: Number of buffered frames to drop
+        warmup: Seconds to keep dropping frames first, so a camera that was
+            just opened can settle its exposure and white balance
+    
+    Returns:
+        Tuple of (ret: bool, frame) like cap.read()
+    """
+    deadline = time.monotonic() + warmup
+    while time.monotonic() < deadline:
+        if not cap.grab():
+            break
+    
+    for _ in range(discard):
+        cap.grab()
+    
+    if not cap.grab():
+        return False, None
+    return cap.retrieve()
+
+
+class FrameGrabber:
+    """
+    Read camera frames on a background thread.
+    
+    The thread keeps the stream moving with cap.grab(), which does not
+    decode, and only decodes (cap.retrieve()) a frame once the caller asks
+    for one. Frames nobody reads are never decoded, and each frame returned
+    is the newest the camera has delivered. read() can be used in place of
+    cap.read(); call stop() before using cap again.
+    """
+    
+    def __init__(self, cap):
+        self._cap = cap
+        self._frames = queue.Queue(maxsize=1)
+        self._wanted = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def read(self, timeout=1.0):
+        """
+        Get the next frame the camera delivers, waiting for it.
+        
+        Returns:
+            Tuple of (ret: bool, frame) like cap.read()
+        """
+        self._wanted.set()
+        try:
+            return self._frames.get(timeout=timeout)
+        except queue.Empty:
+            return False, None
+    
+    def stop(self):
+        """Stop the capture thread and wait for it to exit."""
+        self._stopped.set()
+        self._thread.join()
+    
+    def _run(self):
+        while not self._stopped.is_set():
+            if not self._cap.grab():
+                # Leave failed reads to read()'s timeout instead of spinning
+                self._stopped.wait(0.01)
+                continue
+            
+            if not self._wanted.is_set():
+                continue
+            
+            ret, frame = self._cap.retrieve()
+            if not ret:
+                continue
+            
+            # Drop a frame left over from a read() that timed out; this
+            # thread is the only producer, so there is room afterwards
+            self._wanted.clear()
+            try:
+                self._frames.get_nowait()
+            except queue.Empty:
+                pass
+            self._frames.put_nowait((True, frame))
+
+
+def decode_base64_image(base64_string):
+    """Decode base64 image to OpenCV format."""
+    try:
+        # Remove data URL prefix if present
+        if base64_string.startswith('data:'):
+            base64_string = base64_string.split(',', 1)[1]
+        
+        img_bytes = base64.b64decode(base64_string, validate=False)
+    except Exception as e:
+        print(f"Error decoding image: {e}")
+        return None
+    
+    return decode_image_bytes(img_bytes)
+
+
+def decode_image_bytes(img_bytes):
+    """Decode raw encoded image bytes (JPEG, PNG, ...) to OpenCV format."""
+    try:
+        # Webcam captures are JPEG - libjpeg-turbo decodes (and scales) them faster
+        if turbo_jpeg is not None and img_bytes[:3] == JPEG_MAGIC:
+            return turbo_jpeg.decode(img_bytes, pixel_format=TJPF_BGR,
+                                     scaling_factor=TURBO_JPEG_SCALE)
+        
+        # frombuffer is a zero-copy view over the decoded bytes
+        nparr = np.frombuffer(img_bytes, np.uint8)
+        image = cv2.imdecode(nparr, IMDECODE_FLAG)
+        return image
+    except Exception as e:
+        print(f"Error decoding image: {e}")
+        return None
+
+
+def to_grayscale(image):
+    """Convert a BGR image to grayscale; grayscale images are returned as-is."""
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+@contextmanager
+def checkout_detector():
+    """
+    Borrow a face detector from the process-wide pool for one detection.
+    
+    Neither detector is documented as thread-safe (YuNet keeps the input
+    size as state), so each detector is used by one thread at a time. The
+    pool starts with the detector loaded at import and grows to at most
+    DETECTOR_POOL_SIZE detectors; once all are in use, callers wait for one.
+    Detectors outlive the threads that use them, so short-lived request
+    threads (app.run(threaded=True)) do not reload the model.
+    """
+    global _detectors_created
+    
+    try:
+        detector = _detector_pool.get_nowait()
+    except queue.Empty:
+        with _detector_pool_lock:
+            create = _detectors_created < DETECTOR_POOL_SIZE
+            if create:
+                _detectors_created += 1
+        detector = create_detector() if create else _detector_pool.get()
+    
+    try:
+        yield detector
+    finally:
+        _detector_pool.put(detector)
+
+
+def detect_faces(image, model="hog", detector=None):
     """
-    Detect faces in an image using Haar Cascades.
+    Detect faces in an image using YuNet or Haar Cascades.
     
     Args:
-        image: BGR image from OpenCV
+        image: BGR or grayscale image from OpenCV
         model: Ignored (kept for compatibility signature)
+        detector: Detector from create_detector() (defaults to one borrowed
+            with checkout_detector())
     
     Returns:
         List of face locations as (top, right, bottom, left) tuples
     """
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if detector is None:
+        with checkout_detector() as detector:
+            return detect_faces(image, model, detector)
+    
+    if not isinstance(detector, cv2.CascadeClassifier):
+        return _detect_faces_yunet(image, detector)
+    
+    gray = to_grayscale(image)
+    if USE_OPENCL:
+        gray = cv2.UMat(gray)
     
     # Detect faces
-    faces = face_cascade.detectMultiScale(
+    faces = detector.detectMultiScale(
         gray,
         scaleFactor=1.1,
         minNeighbors=5,
@@ -75,23 +338,256 @@ def detect_faces(image, model="hog"):
     return face_locations
 
 
+def _detect_faces_yunet(image, detector):
+    """Run a cv2.FaceDetectorYN on an image; see detect_faces()."""
+    if image.ndim == 2:
+        # YuNet only takes 3-channel input
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    
+    height, width = image.shape[:2]
+    detector.setInputSize((width, height))
+    _, faces = detector.detect(image)
+    
+    if faces is None:
+        return []
+    
+    # Rows start with x, y, w, h; boxes can extend past the image edges
+    face_locations = []
+    for x, y, w, h in faces[:, :4]:
+        top = max(int(y), 0)
+        left = max(int(x), 0)
+        bottom = min(int(y + h), height)
+        right = min(int(x + w), width)
+        face_locations.append((top, right, bottom, left))
+    
+    return face_locations
+
+
+def detect_faces_scaled(image, max_dim=DETECT_MAX_DIMENSION):
+    """
+    Detect faces on a downscaled copy of a large image.
+    
+    Detection cost grows with pixel count, so images larger than max_dim on
+    their longest side are shrunk before detection.
+    
+    Args:
+        image: BGR or grayscale image from OpenCV
+        max_dim: Longest side (in pixels) to run detection at
+    
+    Returns:
+        List of face locations as (top, right, bottom, left) tuples,
+        in the coordinates of the original image
+    """
+    height, width = image.shape[:2]
+    return detect_faces_downscaled(image, max_dim / max(height, width))
+
+
+def detect_faces_downscaled(image, scale=DETECT_DOWNSCALE):
+    """
+    Detect faces at a fraction of the image resolution.
+    
+    Args:
+        image: BGR or grayscale image from OpenCV
+        scale: Resize factor for detection (1 or more = full resolution)
+    
+    Returns:
+        List of face locations as (top, right, bottom, left) tuples,
+        in the coordinates of the original image
+    """
+    if scale >= 1:
+        return detect_faces(image)
+    
+    # The cascade works on grayscale: convert first so only one channel is resized
+    if not USE_YUNET:
+        image = to_grayscale(image)
+    
+    height, width = image.shape[:2]
+    small = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    
+    face_locations = []
+    for (top, right, bottom, left) in detect_faces(small):
+        face_locations.append((
+            int(top / scale),
+            min(int(right / scale), width),
+            min(int(bottom / scale), height),
+            int(left / scale)
+        ))
+    
+    return face_locations
+
+
+def detect_faces_with_gray(image, scale=DETECT_DOWNSCALE):
+    """
+    Detect faces like detect_faces_downscaled(), converting to grayscale once.
+    
+    The full-resolution grayscale image is returned too, so it can be passed
+    straight to encode_face() instead of converting the frame again.
+    
+    Returns:
+        Tuple of (face locations, grayscale image)
+    """
+    gray = to_grayscale(image)
+    return detect_faces_downscaled(image if USE_YUNET else gray, scale), gray
+
+
+def detect_faces_near(image, face_location, margin=REGISTRATION_TRACK_MARGIN, detect=None):
+    """
+    Detect faces only in the region around a previous face location.
+    
+    Args:
+        image: BGR or grayscale image from OpenCV
+        face_location: Previous (top, right, bottom, left) of the face
+        margin: Padding around the previous box, as a fraction of its size
+        detect: Detection function to run on the region (default: detect_faces_downscaled)
+    
+    Returns:
+        List of face locations as (top, right, bottom, left) tuples,
+        in the coordinates of the original image
+    """
+    if detect is None:
+        detect = detect_faces_downscaled
+    
+    height, width = image.shape[:2]
+    top, right, bottom, left = face_location
+    pad_y = int((bottom - top) * margin)
+    pad_x = int((right - left) * margin)
+    
+    y0, y1 = max(top - pad_y, 0), min(bottom + pad_y, height)
+    x0, x1 = max(left - pad_x, 0), min(right + pad_x, width)
+    if y1 <= y0 or x1 <= x0:
+        return []
+    
+    return [
+        (t + y0, r + x0, b + y0, l + x0)
+        for (t, r, b, l) in detect(image[y0:y1, x0:x1])
+    ]
+
+
+class FaceDetectionWorker:
+    """
+    Run face detection on a background thread while the caller keeps capturing.
+    
+    The caller submits frames as it reads them; the worker always detects the
+    most recent one (older frames still waiting are dropped), so capture and
+    detection overlap instead of running one after the other.
+    
+    With track=True, once a single face is found later frames are only
+    searched around it (see detect_faces_near), falling back to the full
+    frame when it is lost and every REGISTRATION_FULL_DETECT_EVERY frames.
+    
+    Frames that are dropped or superseded go back to a pool, so the caller
+    can read into them (cap.read(worker.get_buffer())) instead of having
+    OpenCV allocate a new array for every frame.
+    """
+    
+    def __init__(self, detect=detect_faces_downscaled, track=False):
+        self._detect = detect
+        self._track = track
+        self._frames = queue.Queue(maxsize=1)
+        self._lock = threading.Lock()
+        self._latest = None
+        self._free_frames = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def get_buffer(self):
+        """
+        Get a frame array that is no longer in use, to read the next frame into.
+        
+        Returns:
+            ndarray, or None if none is free yet (cap.read() then allocates one)
+        """
+        try:
+            return self._free_frames.get_nowait()
+        except queue.Empty:
+            return None
+    
+    def submit(self, frame_number, frame):
+        """
+        Queue a frame for detection, replacing any frame not yet picked up.
+        
+        The worker owns the frame from here on: the caller must not write to
+        it, and it may be handed out again by get_buffer() once superseded.
+        """
+        try:
+            _, dropped = self._frames.get_nowait()
+            self._free_frames.put(dropped)
+        except queue.Empty:
+            pass
+        # The caller is the only producer, so there is room now
+        self._frames.put_nowait((frame_number, frame))
+    
+    def latest(self):
+        """
+        Get the most recent detection result.
+        
+        Returns:
+            Tuple of (frame_number, frame, face_locations), or None before
+            the first frame has been processed
+        """
+        with self._lock:
+            return self._latest
+    
+    def stop(self):
+        """Stop the worker thread and wait for it to exit."""
+        try:
+            self._frames.get_nowait()
+        except queue.Empty:
+            pass
+        self._frames.put(None)
+        self._thread.join()
+    
+    def _run(self):
+        previous = None
+        since_full_detect = 0
+        
+        while True:
+            item = self._frames.get()
+            if item is None:
+                break
+            
+            frame_number, frame = item
+            faces = []
+            
+            since_full_detect += 1
+            if previous is not None and since_full_detect < REGISTRATION_FULL_DETECT_EVERY:
+                faces = detect_faces_near(frame, previous, detect=self._detect)
+            if len(faces) != 1:
+                faces = self._detect(frame)
+                since_full_detect = 0
+            
+            if self._track and len(faces) == 1:
+                previous = faces[0]
+            else:
+                previous = None
+            
+            with self._lock:
+                superseded = self._latest
+                self._latest = (frame_number, frame, faces)
+            
+            # The caller reads the latest result and uses it before it reads
+            # its next frame, so the previous result's frame is free again
+            if superseded is not None:
+                self._free_frames.put(superseded[1])
+
+
 def encode_face(image, face_location=None, num_jitters=1):
     """
     Generate a simplified face encoding by resizing and flattening the face image.
     WARNING: This is NOT a deep learning encoding and has low accuracy.
     
     Args:
-        image: BGR image from OpenCV
+        image: BGR or grayscale image from OpenCV
         face_location: Optional specific face location (top, right, bottom, left)
         num_jitters: Ignored
     
     Returns:
         numpy array of floats representing face encoding, or None if no face found
     """
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gray = to_grayscale(image)
     
     if face_location is None:
-        faces = detect_faces(image)
+        faces = detect_faces(gray)
         if not faces:
             return None
         face_location = faces[0]
@@ -107,7 +603,7 @@ def encode_face(image, face_location=None, num_jitters=1):
     # Resize to fixed size for consistent encoding length (e.g., 64x64)
     # 64x64 = 4096 dimensions
     try:
-        resized_face = cv2.resize(face_roi, (64, 64))
+        resized_face = cv2.resize(face_roi, FACE_SIZE)
         
         # Flatten and normalize
         encoding = resized_face.flatten().astype('float32')
@@ -142,53 +638,400 @@ def compare_faces(known_encoding, unknown_encoding, tolerance=None):
     if known_encoding.shape != unknown_encoding.shape:
         return False, 1.0
         
-    mse = np.mean((known_encoding - unknown_encoding) ** 2)
+    # Compare the squared distance against the tolerance scaled up to the
+    # same units; the mean is only taken for the returned distance
+    diff = np.subtract(known_encoding, unknown_encoding, dtype=np.float32)
+    sq_dist = float(diff @ diff)
+    
+    is_match = sq_dist <= tolerance * diff.size
+    
+    return is_match, sq_dist / diff.size
+
+
+def match_confidence(distance, tolerance):
+    """Confidence (0-100) of a match at the given MSE distance."""
+    # Scale confidence based on how close it is to 0 relative to tolerance
+    return max(0, (tolerance - distance) / tolerance) * 100
+
+
+# Stacked float32 encodings plus squared row norms, so distances can be taken
+# as ||a||^2 + ||b||^2 - 2ab with a single matrix-vector product, and a FAISS
+# index over them for large user counts (None otherwise)
+StackedEncodings = namedtuple('StackedEncodings', ['usernames', 'matrix', 'sq_norms', 'search_index'])
+
+
+def index_encodings(usernames, matrix):
+    """
+    Wrap an (N, D) encoding matrix for matching, precomputing its row norms.
+    
+    Args:
+        usernames: List of usernames, one per matrix row
+        matrix: ndarray of shape (N, D)
+    
+    Returns:
+        StackedEncodings
+    """
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    sq_norms = np.einsum('ij,ij->i', matrix, matrix)
+    return StackedEncodings(usernames, matrix, sq_norms, build_search_index(matrix))
+
+
+def stack_encodings(known_encodings_dict, dim=ENCODING_DIM):
+    """
+    Stack a dict of encodings into a contiguous matrix for vectorized matching.
+    
+    Args:
+        known_encodings_dict: Dict of {username: encoding}
+        dim: Encoding length to keep (rows of any other length are skipped)
+    
+    Returns:
+        StackedEncodings of (usernames: list, matrix: float32 ndarray of
+        shape (N, dim), sq_norms)
+    """
+    usernames = []
+    rows = []
+    
+    for username, encoding in known_encodings_dict.items():
+        encoding = np.asarray(encoding, dtype=np.float32).ravel()
+        if encoding.shape[0] != dim:
+            continue
+        usernames.append(username)
+        rows.append(encoding)
     
-    is_match = mse <= tolerance
+    if not rows:
+        return index_encodings([], np.empty((0, dim), dtype=np.float32))
     
-    return is_match, mse
+    return index_encodings(usernames, np.stack(rows))
 
 
-def find_best_match(unknown_encoding, known_encodings_dict, tolerance=0.15):
+# int8 copy of a stacked encoding matrix: row i is approximately codes[i] * scales[i]
+QuantizedEncodings = namedtuple('QuantizedEncodings', ['usernames', 'codes', 'scales', 'sq_norms'])
+
+
+def quantize_encodings(usernames, matrix):
+    """
+    Quantize a stacked encoding matrix to int8 with one scale per row.
+    
+    Args:
+        usernames: List of usernames, one per matrix row
+        matrix: float32 ndarray of shape (N, D)
+    
+    Returns:
+        QuantizedEncodings (int8 codes, float32 scales and squared row norms)
+    """
+    codes, scales = quantize(matrix)
+    sq_norms = np.einsum('ij,ij->i', matrix, matrix).astype(np.float32)
+    return QuantizedEncodings(usernames, codes, scales, sq_norms)
+
+
+class EncodingStore:
+    """
+    Growable (N, D) float32 encoding matrix with a parallel list of usernames.
+    
+    Rows live in one contiguous buffer that doubles when it fills up, so
+    registering a user writes one row instead of restacking every encoding.
+    StackedEncodings handed out by stacked() stay valid while the store
+    changes: add() only writes past the rows they cover, and replacing or
+    removing a row works on a copy of the buffer.
+    
+    With quantized=True an int8 copy of every row (see quantize()) is kept
+    alongside, one row at a time, for quantized().
+    """
+    
+    def __init__(self, dim=ENCODING_DIM, capacity=64, quantized=False):
+        self.dim = dim
+        self._matrix = np.empty((max(capacity, 1), dim), dtype=np.float32)
+        self._sq_norms = np.empty(max(capacity, 1), dtype=np.float32)
+        self._codes = np.empty((max(capacity, 1), dim), dtype=np.int8) if quantized else None
+        self._scales = np.empty(max(capacity, 1), dtype=np.float32) if quantized else None
+        self._usernames = []
+        self._rows = {}
+        self._stacked = None
+        self._quantized = None
+    
+    @classmethod
+    def from_matrix(cls, usernames, matrix, quantized=False):
+        """Create a store holding the rows of an (N, D) matrix."""
+        store = cls(matrix.shape[1], capacity=2 * len(usernames), quantized=quantized)
+        n = len(usernames)
+        store._matrix[:n] = matrix
+        store._sq_norms[:n] = np.einsum('ij,ij->i', store._matrix[:n], store._matrix[:n])
+        if quantized and n:
+            store._codes[:n], store._scales[:n] = quantize(store._matrix[:n])
+        store._usernames = list(usernames)
+        store._rows = {username: i for i, username in enumerate(usernames)}
+        return store
+    
+    def __len__(self):
+        return len(self._usernames)
+    
+    def __contains__(self, username):
+        return username in self._rows
+    
+    def add(self, username, encoding):
+        """Add a user's encoding, replacing the existing one if already stored."""
+        encoding = np.asarray(encoding, dtype=np.float32).ravel()
+        if encoding.shape[0] != self.dim:
+            return
+        
+        row = self._rows.get(username)
+        if row is not None:
+            self._copy_buffers()
+        else:
+            row = len(self._usernames)
+            if row == len(self._matrix):
+                self._grow()
+            self._usernames.append(username)
+            self._rows[username] = row
+        
+        self._matrix[row] = encoding
+        self._sq_norms[row] = encoding @ encoding
+        if self._codes is not None:
+            codes, scales = quantize(encoding[None, :])
+            self._codes[row], self._scales[row] = codes[0], scales[0]
+        self._stacked = self._quantized = None
+    
+    def remove(self, username):
+        """
+        Remove a user's encoding (the last row moves into its slot).
+        
+        Returns:
+            True if removed, False if the user was not stored
+        """
+        row = self._rows.pop(username, None)
+        if row is None:
+            return False
+        
+        last = len(self._usernames) - 1
+        self._copy_buffers()
+        if row != last:
+            moved = self._usernames[last]
+            self._matrix[row] = self._matrix[last]
+            self._sq_norms[row] = self._sq_norms[last]
+            if self._codes is not None:
+                self._codes[row] = self._codes[last]
+                self._scales[row] = self._scales[last]
+            self._usernames[row] = moved
+            self._rows[moved] = row
+        self._usernames.pop()
+        
+        self._stacked = self._quantized = None
+        return True
+    
+    def stacked(self):
+        """
+        Get the stored encodings for find_best_match().
+        
+        Returns:
+            StackedEncodings over the first N rows of the buffer (no copy)
+        """
+        if self._stacked is None:
+            n = len(self._usernames)
+            matrix = self._matrix[:n]
+            self._stacked = StackedEncodings(list(self._usernames), matrix,
+                                             self._sq_norms[:n], build_search_index(matrix))
+        return self._stacked
+    
+    def quantized(self):
+        """
+        Get the int8 copy of the stored encodings for find_best_match().
+        
+        Returns:
+            QuantizedEncodings over the first N rows (no copy), or None if the
+            store was created without quantized=True
+        """
+        if self._codes is None:
+            return None
+        if self._quantized is None:
+            n = len(self._usernames)
+            self._quantized = QuantizedEncodings(list(self._usernames), self._codes[:n],
+                                                 self._scales[:n], self._sq_norms[:n])
+        return self._quantized
+    
+    def _copy_buffers(self):
+        self._matrix = self._matrix.copy()
+        self._sq_norms = self._sq_norms.copy()
+        if self._codes is not None:
+            self._codes = self._codes.copy()
+            self._scales = self._scales.copy()
+    
+    def _grow(self):
+        n = len(self._usernames)
+        capacity = 2 * len(self._matrix)
+        
+        def grown(array):
+            bigger = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+            bigger[:n] = array[:n]
+            return bigger
+        
+        self._matrix = grown(self._matrix)
+        self._sq_norms = grown(self._sq_norms)
+        if self._codes is not None:
+            self._codes = grown(self._codes)
+            self._scales = grown(self._scales)
+
+
+def find_best_match(unknown_encoding, known_encodings, tolerance=0.15):
     """
     Find the best matching face.
     
+    All known encodings are compared in a single vectorized pass (see
+    face_math.batch_sqeuclid).
+    
     Args:
         unknown_encoding: Face encoding to identify
-        known_encodings_dict: Dict of {username: encoding}
+        known_encodings: Dict of {username: encoding}, StackedEncodings as
+            returned by stack_encodings(), a plain (usernames, matrix) tuple,
+            or QuantizedEncodings
         tolerance: MSE threshold
     
     Returns:
         Tuple of (username: str or None, distance: float, confidence: float)
     """
-    if not known_encodings_dict:
-        return None, float('inf'), 0.0
+    unknown_encoding = np.asarray(unknown_encoding, dtype=np.float32).ravel()
     
-    best_match = None
-    best_distance = float('inf')
+    if isinstance(known_encodings, QuantizedEncodings):
+        usernames, matrix = known_encodings.usernames, known_encodings.codes
+    else:
+        if isinstance(known_encodings, dict):
+            known_encodings = stack_encodings(known_encodings, unknown_encoding.shape[0])
+        elif not isinstance(known_encodings, StackedEncodings):
+            known_encodings = StackedEncodings(*known_encodings, None, None)
+        usernames, matrix = known_encodings.usernames, known_encodings.matrix
     
-    for username, known_encoding in known_encodings_dict.items():
-        known_encoding = np.array(known_encoding)
-        
-        # Ensure shapes match
-        if known_encoding.shape != unknown_encoding.shape:
-            continue
-            
-        is_match, distance = compare_faces(known_encoding, unknown_encoding, tolerance)
-        
-        if distance < best_distance:
-            best_distance = distance
-            best_match = username
+    if not usernames or matrix.shape[1] != unknown_encoding.shape[0]:
+        return None, float('inf'), 0.0
+    
+    # Mean Squared Error against every known encoding at once
+    if isinstance(known_encodings, QuantizedEncodings):
+        distances = quantized_sq_distances(unknown_encoding, known_encodings.codes,
+                                           known_encodings.scales, known_encodings.sq_norms)
+        best_index = int(distances.argmin())
+        best_sq_dist = max(float(distances[best_index]), 0.0)
+    elif known_encodings.search_index is not None:
+        best_index, best_sq_dist = search_index(known_encodings.search_index, unknown_encoding)
+    else:
+        best_index, best_sq_dist = batch_sqeuclid(matrix, unknown_encoding,
+                                                  known_encodings.sq_norms)
+    best_distance = best_sq_dist / unknown_encoding.shape[0]
     
-    # Calculate confidence
-    if best_distance <= tolerance:
-        # Scale confidence based on how close it is to 0 relative to tolerance
-        confidence = max(0, (tolerance - best_distance) / tolerance) * 100
-        return best_match, best_distance, confidence
+    # Decide on the squared distance itself (tolerance scaled to its units)
+    if best_sq_dist <= tolerance * unknown_encoding.shape[0]:
+        return usernames[best_index], best_distance, match_confidence(best_distance, tolerance)
     
     return None, best_distance, 0.0
 
 
+def analyze_face_image(image_data, check_liveness=False, single_face=False):
+    """
+    Decode an uploaded image, then run liveness, detection and encoding on it.
+    
+    Runs the whole sequence in one call so it can be shipped to a worker
+    process with a single round trip (see run_face_task). Faces are detected
+    once and shared with the liveness check.
+    
+    Args:
+        image_data: Base64 (or data URL) string, or raw encoded image bytes
+        check_liveness: Run the liveness check first
+        single_face: Reject images containing more than one face
+    
+    Returns:
+        Tuple of (failure_reason: str or None, encoding, liveness_score, message)
+        failure_reason is one of 'invalid_image', 'liveness_failed',
+        'no_face_detected', 'multiple_faces', 'encoding_failed'
+    """
+    # Liveness verdicts are never reused: a replayed upload must be checked
+    # again rather than inherit an earlier pass
+    if ANALYZE_CACHE_SIZE <= 0 or check_liveness:
+        return _analyze_face_image(image_data, check_liveness, single_face)
+    
+    raw = image_data if isinstance(image_data, bytes) else image_data.encode('utf-8', 'replace')
+    key = (hashlib.blake2b(raw, digest_size=16).digest(), check_liveness, single_face)
+    
+    with _analyze_cache_lock:
+        result = _analyze_cache.get(key)
+        if result is not None:
+            _analyze_cache.move_to_end(key)
+            return _copy_analysis(result)
+    
+    result = _analyze_face_image(image_data, check_liveness, single_face)
+    
+    # The cache keeps its own copy, so callers can't change what later
+    # callers get back
+    with _analyze_cache_lock:
+        _analyze_cache[key] = _copy_analysis(result)
+        if len(_analyze_cache) > ANALYZE_CACHE_SIZE:
+            _analyze_cache.popitem(last=False)
+    
+    return result
+
+
+def _copy_analysis(result):
+    """Copy an analyze_face_image() result, including its encoding array."""
+    failure_reason, encoding, liveness_score, message = result
+    if encoding is not None:
+        encoding = encoding.copy()
+    return failure_reason, encoding, liveness_score, message
+
+
+def _analyze_face_image(image_data, check_liveness, single_face):
+    """Uncached body of analyze_face_image()."""
+    from liveness import verify_liveness_api
+    
+    if isinstance(image_data, bytes):
+        image = decode_image_bytes(image_data)
+    else:
+        image = decode_base64_image(image_data)
+    if image is None:
+        return 'invalid_image', None, 0.0, None
+    
+    # Detection and encoding both work on grayscale - convert once for both
+    gray = to_grayscale(image)
+    faces = detect_faces_scaled(gray)
+    
+    liveness_score = 0.0
+    if check_liveness:
+        is_live, liveness_score, msg = verify_liveness_api(image, faces=faces)
+        if not is_live:
+            return 'liveness_failed', None, liveness_score, msg
+    
+    if not faces:
+        return 'no_face_detected', None, liveness_score, None
+    
+    if single_face and len(faces) > 1:
+        return 'multiple_faces', None, liveness_score, None
+    
+    encoding = encode_face(gray, faces[0])
+    if encoding is None:
+        return 'encoding_failed', None, liveness_score, None
+    
+    return None, encoding, liveness_score, None
+
+
+def get_face_pool():
+    """Get the face processing pool, or None when FACE_WORKER_PROCESSES is 0."""
+    global _face_pool
+    if _face_pool is None and FACE_WORKER_PROCESSES > 0:
+        # Request threads can race here on first use; only one may create the pool
+        with _face_pool_lock:
+            if _face_pool is None:
+                # Spawn fresh workers: forking a process that already started OpenCV/Numba
+                # threads can deadlock. Each worker loads its own detector on import.
+                _face_pool = ProcessPoolExecutor(
+                    max_workers=FACE_WORKER_PROCESSES,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+    return _face_pool
+
+
+def run_face_task(func, *args, **kwargs):
+    """Run a CPU-heavy face function in the worker pool, or inline without one."""
+    pool = get_face_pool()
+    if pool is None:
+        return func(*args, **kwargs)
+    return pool.submit(func, *args, **kwargs).result()
+
+
 def draw_face_box(image, face_location, name="", color=(0, 255, 0)):
     """
     Draw bounding box around face.
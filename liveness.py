@@ -7,12 +7,54 @@ Refactored for pure OpenCV usage (no dlib landmarks).
 import cv2
 import numpy as np
 import time
-from face_utils import detect_faces
+from face_utils import (
+    FrameGrabber, decode_base64_image, detect_faces_downscaled, detect_faces_scaled
+)
 from config import (
-    SHOW_PREVIEW
+    SHOW_PREVIEW,
+    LIVENESS_FRAME_HISTORY,
+    LIVENESS_THUMBNAIL_SIZE,
+    LIVENESS_DETECT_EVERY
 )
 
 
+class _FrameHistory:
+    """
+    The last LIVENESS_FRAME_HISTORY frames, as small thumbnails.
+    
+    Thumbnails are resized straight into one preallocated ring buffer, so
+    recording a frame allocates nothing.
+    """
+    
+    def __init__(self):
+        width, height = LIVENESS_THUMBNAIL_SIZE
+        self._buffer = np.empty((LIVENESS_FRAME_HISTORY, height, width, 3), dtype=np.uint8)
+        self._count = 0
+    
+    def append(self, frame):
+        """Record a BGR frame, overwriting the oldest one once full."""
+        slot = self._buffer[self._count % len(self._buffer)]
+        cv2.resize(frame, LIVENESS_THUMBNAIL_SIZE, dst=slot, interpolation=cv2.INTER_AREA)
+        self._count += 1
+    
+    def frames(self):
+        """Get the recorded thumbnails, oldest first (views into the buffer)."""
+        size = len(self._buffer)
+        return [self._buffer[i % size] for i in range(max(0, self._count - size), self._count)]
+
+
+def _display_copy(frame, buffer):
+    """
+    Copy a frame into a reusable preview buffer, (re)allocating it only when
+    the frame size changes. Overlays are drawn on the copy because the frame
+    itself may be kept as the best frame to match.
+    """
+    if buffer is None or buffer.shape != frame.shape:
+        buffer = np.empty_like(frame)
+    np.copyto(buffer, frame)
+    return buffer
+
+
 def detect_blink(cap, timeout=5):
     """
     Detect blink - DISABLED in OpenCV-only mode.
@@ -23,11 +65,14 @@ def detect_blink(cap, timeout=5):
         timeout: Maximum seconds to wait
     
     Returns:
-        Tuple of (blink_detected: bool, frames_captured: list, liveness_score: float)
+        Tuple of (blink_detected: bool, frames_captured: list of recent
+        thumbnails, liveness_score: float, best_frame: full-resolution frame)
     """
     print("\n🔍 Liveness Check: Blink detection disabled (No landmarks).")
     
-    frames_captured = []
+    frames_captured = _FrameHistory()
+    best_frame = None
+    display_frame = None
     start_time = time.time()
     
     # Just capture some frames to simulate checking
@@ -35,14 +80,16 @@ def detect_blink(cap, timeout=5):
         ret, frame = cap.read()
         if not ret:
             break
-        frames_captured.append(frame.copy())
+        frames_captured.append(frame)
+        best_frame = frame
         
         if SHOW_PREVIEW:
-            cv2.putText(frame, "Liveness: Checking...", (10, 30),
+            display_frame = _display_copy(frame, display_frame)
+            cv2.putText(display_frame, "Liveness: Checking...", (10, 30),
                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
-            cv2.imshow("Liveness Check", frame)
+            cv2.imshow("Liveness Check", display_frame)
             
-        if cv2.waitKey(1) & 0xFF == ord('q'):
+        if SHOW_PREVIEW and cv2.waitKey(1) & 0xFF == ord('q'):
             break
             
     if SHOW_PREVIEW:
@@ -50,7 +97,7 @@ def detect_blink(cap, timeout=5):
         
     # Always return True in this mode since we can't verify
     print("✓ Blink check skipped (compatibility mode)")
-    return True, frames_captured, 50.0
+    return True, frames_captured.frames(), 50.0, best_frame
 
 
 def detect_head_movement(cap, timeout=None):
@@ -58,19 +105,28 @@ def detect_head_movement(cap, timeout=None):
     Detect head movement - Simplified to movement detection.
     
     Args:
-        cap: OpenCV VideoCapture object
+        cap: OpenCV VideoCapture object or FrameGrabber
         timeout: Maximum seconds to wait
     
     Returns:
-        Tuple of (movement_detected: bool, frames_captured: list, liveness_score: float)
+        Tuple of (movement_detected: bool, frames_captured: list of recent
+        thumbnails, liveness_score: float, best_frame: latest full-resolution
+        frame with a face, or None)
     """
     print("\n🔍 Liveness Check: Please MOVE your head slightly...")
     
     if timeout is None:
         timeout = 5
         
-    frames_captured = []
-    face_positions = []
+    frames_captured = _FrameHistory()
+    frames_seen = 0
+    faces = []
+    best_frame = None
+    display_frame = None
+    # Only the range of face positions and the number seen are needed, not
+    # a list of every position
+    min_x = min_y = max_x = max_y = None
+    positions_seen = 0
     movement_detected = False
     start_time = time.time()
     
@@ -78,80 +134,105 @@ def detect_head_movement(cap, timeout=None):
         ret, frame = cap.read()
         if not ret:
             continue
-            
-        frames_captured.append(frame.copy())
         
-        # Detect faces
-        faces = detect_faces(frame)
+        frames_captured.append(frame)
+        frames_seen += 1
+        
+        # Detect faces on a downscaled grayscale copy (positions are
+        # still in full-frame pixels). Skipped frames keep the last faces,
+        # unless the face was lost on the previous frame
+        detected = not faces or (frames_seen - 1) % LIVENESS_DETECT_EVERY == 0
+        if detected:
+            faces = detect_faces_downscaled(frame)
+            
+            # cap.read() returns a new array each time, so keeping a reference is enough
+            if faces:
+                best_frame = frame
         
-        display_frame = frame.copy()
+        display_frame = _display_copy(frame, display_frame) if SHOW_PREVIEW else frame
         
-        if faces:
+        if faces and detected:
             top, right, bottom, left = faces[0]
             center_x = (left + right) // 2
             center_y = (top + bottom) // 2
             
-            face_positions.append((center_x, center_y))
+            if positions_seen == 0:
+                min_x = max_x = center_x
+                min_y = max_y = center_y
+            else:
+                min_x, max_x = min(min_x, center_x), max(max_x, center_x)
+                min_y, max_y = min(min_y, center_y), max(max_y, center_y)
+            positions_seen += 1
             
             # Check for movement if we have enough points
-            if len(face_positions) > 3:
-                # Calculate movement magnitude
-                dx = abs(face_positions[-1][0] - face_positions[0][0])
-                dy = abs(face_positions[-1][1] - face_positions[0][1])
+            if positions_seen > 3:
+                # Movement magnitude: peak-to-peak over every position seen,
+                # so motion away from and back past the start still counts
+                dx = max_x - min_x
+                dy = max_y - min_y
                 
                 if dx > 20 or dy > 20:  # Threshold for movement
                     movement_detected = True
-                    cv2.putText(display_frame, "MOVEMENT DETECTED!", (10, 60),
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+                    if SHOW_PREVIEW:
+                        cv2.putText(display_frame, "MOVEMENT DETECTED!", (10, 60),
+                                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
         
         if SHOW_PREVIEW:
             cv2.putText(display_frame, f"Movement: {'YES' if movement_detected else 'NO'}", (10, 30),
                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0) if movement_detected else (0, 0, 255), 2)
             cv2.imshow("Liveness Check", display_frame)
             
-        if cv2.waitKey(1) & 0xFF == ord('q'):
+        if SHOW_PREVIEW and cv2.waitKey(1) & 0xFF == ord('q'):
             break
             
-        if movement_detected and len(frames_captured) > 10:
+        if movement_detected and frames_seen > 10:
             time.sleep(0.5)
             break
             
     if SHOW_PREVIEW:
         cv2.destroyWindow("Liveness Check")
         
-    return movement_detected, frames_captured, 80.0 if movement_detected else 0.0
+    return movement_detected, frames_captured.frames(), 80.0 if movement_detected else 0.0, best_frame
 
 
 def verify_liveness(cap, require_blink=False, challenge_mode="random"):
     """
     Perform liveness verification.
+    
+    Returns:
+        Tuple of (is_live: bool, frame: full-resolution frame to match, or None)
     """
-    # Simplified flow
-    return detect_head_movement(cap)
+    # Simplified flow. Frames are read on a background thread so capture
+    # overlaps with detection
+    grabber = FrameGrabber(cap)
+    try:
+        is_live, _, _, best_frame = detect_head_movement(grabber)
+    finally:
+        grabber.stop()
+    return is_live, best_frame
 
 
-def verify_liveness_api(frame_data):
+def verify_liveness_api(frame_data, faces=None):
     """
     API-friendly liveness verification for single frame analysis.
     Simplified checks only.
-    """
-    import base64
     
-    # Decode if base64
+    Args:
+        frame_data: BGR image or base64 encoded image
+        faces: Face locations already detected in this frame, if any
+    """
+    # Decode if base64 (same decoder as the upload endpoints: pybase64 and
+    # TurboJPEG when installed, IMAGE_DECODE_REDUCTION applied)
     if isinstance(frame_data, str):
-        try:
-            if ',' in frame_data:
-                frame_data = frame_data.split(',')[1]
-            img_bytes = base64.b64decode(frame_data)
-            nparr = np.frombuffer(img_bytes, np.uint8)
-            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        except:
+        frame = decode_base64_image(frame_data)
+        if frame is None:
             return False, 0.0, "Invalid image data"
     else:
         frame = frame_data
         
     # Just check if a face exists
-    faces = detect_faces(frame)
+    if faces is None:
+        faces = detect_faces_scaled(frame)
     
     if not faces:
         return False, 0.0, "No face detected"
@@ -11,56 +11,59 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from auth import register_user, login, verify_specific_user, remove_user, get_all_users
 from database import get_user_count
+from config import (
+    FACE_MATCH_TOLERANCE, LIVENESS_ENABLED,
+    REGISTRATION_FRAMES, CAMERA_INDEX
+)
 
 
-def print_banner():
-    """Print application banner."""
-    print("\n" + "="*60)
-    print("""
+BANNER = "\n" + "="*60 + "\n" + """
     ███████╗ █████╗  ██████╗███████╗    ██╗      ██████╗  ██████╗ ██╗███╗   ██╗
     ██╔════╝██╔══██╗██╔════╝██╔════╝    ██║     ██╔═══██╗██╔════╝ ██║████╗  ██║
     █████╗  ███████║██║     █████╗      ██║     ██║   ██║██║  ███╗██║██╔██╗ ██║
     ██╔══╝  ██╔══██║██║     ██╔══╝      ██║     ██║   ██║██║   ██║██║██║╚██╗██║
     ██║     ██║  ██║╚██████╗███████╗    ███████╗╚██████╔╝╚██████╔╝██║██║ ╚████║
     ╚═╝     ╚═╝  ╚═╝ ╚═════╝╚══════╝    ╚══════╝ ╚═════╝  ╚═════╝ ╚═╝╚═╝  ╚═══╝
-    """)
-    print("                  Secure Face Recognition System")
-    print("="*60)
+    """ + "\n                  Secure Face Recognition System\n" + "="*60
+
+# Built once; only the user count line above it changes between redraws
+MENU = "\n".join([
+    "",
+    "┌─────────────────────────────────────┐",
+    "│           MAIN MENU                 │",
+    "├─────────────────────────────────────┤",
+    "│  1. 📝 Register New User            │",
+    "│  2. 🔐 Login with Face              │",
+    "│  3. ✓  Verify Specific User         │",
+    "│  4. 👥 List Registered Users        │",
+    "│  5. 🗑  Delete User                  │",
+    "│  6. ⚙  Settings Info                │",
+    "│  7. 🚪 Exit                         │",
+    "└─────────────────────────────────────┘",
+])
+
+
+def print_banner():
+    """Print application banner."""
+    print(BANNER)
 
 
 def print_menu():
-    """Print main menu."""
+    """Print main menu (one write, so slow consoles redraw it at once)."""
     user_count = get_user_count()
-    print(f"\n📊 Registered Users: {user_count}")
-    print("\n┌─────────────────────────────────────┐")
-    print("│           MAIN MENU                 │")
-    print("├─────────────────────────────────────┤")
-    print("│  1. 📝 Register New User            │")
-    print("│  2. 🔐 Login with Face              │")
-    print("│  3. ✓  Verify Specific User         │")
-    print("│  4. 👥 List Registered Users        │")
-    print("│  5. 🗑  Delete User                  │")
-    print("│  6. ⚙  Settings Info                │")
-    print("│  7. 🚪 Exit                         │")
-    print("└─────────────────────────────────────┘")
+    print(f"\n📊 Registered Users: {user_count}\n{MENU}")
 
 
 def show_settings():
     """Display current settings."""
-    from config import (
-        FACE_RECOGNITION_MODEL, FACE_ENCODING_JITTERS,
-        FACE_MATCH_TOLERANCE, LIVENESS_ENABLED,
-        REGISTRATION_FRAMES, CAMERA_INDEX
-    )
-    
-    print("\n⚙ Current Settings:")
-    print(f"  • Recognition Model: {FACE_RECOGNITION_MODEL}")
-    print(f"  • Encoding Jitters: {FACE_ENCODING_JITTERS}")
-    print(f"  • Match Tolerance: {FACE_MATCH_TOLERANCE}")
-    print(f"  • Liveness Detection: {'Enabled' if LIVENESS_ENABLED else 'Disabled'}")
-    print(f"  • Registration Frames: {REGISTRATION_FRAMES}")
-    print(f"  • Camera Index: {CAMERA_INDEX}")
-    print("\n  (Edit config.py to change settings)")
+    print("\n".join([
+        "\n⚙ Current Settings:",
+        f"  • Match Tolerance: {FACE_MATCH_TOLERANCE}",
+        f"  • Liveness Detection: {'Enabled' if LIVENESS_ENABLED else 'Disabled'}",
+        f"  • Registration Frames: {REGISTRATION_FRAMES}",
+        f"  • Camera Index: {CAMERA_INDEX}",
+        "\n  (Edit config.py to change settings)",
+    ]))
 
 
 def main():
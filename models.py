@@ -20,10 +20,13 @@ class User(db.Model):
     username = db.Column(db.String(80), unique=True, nullable=False, index=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=True)  # Optional for face-only users
-    role = db.Column(db.String(20), nullable=False, default='user')  # 'admin' or 'user'
+    role = db.Column(db.String(20), nullable=False, default='user', index=True)  # 'admin' or 'user'
     
-    # Face encoding stored as JSON string (128 floats)
-    face_encoding = db.Column(db.Text, nullable=True)
+    # Face encoding stored as raw little-endian float32 bytes. Deferred: it is
+    # only read on access (matching reads it with its own query), so loading
+    # a User does not pull the blob. has_face is loaded instead.
+    face_encoding = db.deferred(db.Column(db.LargeBinary, nullable=True))
+    has_face = db.column_property(face_encoding.expression.isnot(None))
     
     # Timestamps
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -39,7 +42,30 @@ class User(db.Model):
     
     def set_password(self, password):
         """Hash and set password."""
-        self.password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        self.password_hash = bcrypt.hashpw(
+            password.encode('utf-8'), bcrypt.gensalt(rounds=self.bcrypt_rounds())
+        ).decode('utf-8')
+    
+    def bcrypt_rounds(self):
+        """bcrypt work factor required for this user's role."""
+        from config import BCRYPT_ROUNDS
+        return max(BCRYPT_ROUNDS, 12) if self.is_admin() else BCRYPT_ROUNDS
+    
+    def password_needs_rehash(self):
+        """
+        Check if the stored hash is weaker than the role now requires
+        (e.g. hashed before the user was promoted to admin).
+        
+        Call after a successful check_password() and re-set the password if so.
+        """
+        if not self.password_hash:
+            return False
+        # bcrypt hashes look like $2b$<cost>$<salt+hash>
+        try:
+            rounds = int(self.password_hash.split('$')[2])
+        except (IndexError, ValueError):
+            return True
+        return rounds < self.bcrypt_rounds()
     
     def check_password(self, password):
         """Verify password."""
@@ -48,18 +74,23 @@ class User(db.Model):
         return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
     
     def set_face_encoding(self, encoding):
-        """Store face encoding as JSON."""
-        if isinstance(encoding, np.ndarray):
-            self.face_encoding = json.dumps(encoding.tolist())
-        else:
-            self.face_encoding = json.dumps(encoding)
+        """Store face encoding as raw float32 bytes."""
+        self.face_encoding = np.asarray(encoding, dtype='<f4').ravel().tobytes()
     
     def get_face_encoding(self):
         """Retrieve face encoding as numpy array."""
         if self.face_encoding:
-            return np.array(json.loads(self.face_encoding))
+            return np.frombuffer(self.face_encoding, dtype='<f4').copy()
         return None
     
+    def mark_login(self):
+        """
+        Set last_login without bumping updated_at, which stays a record of
+        profile and face changes (the face cache's version stamp uses it).
+        """
+        self.last_login = datetime.utcnow()
+        self.updated_at = User.updated_at
+    
     def is_admin(self):
         """Check if user has admin role."""
         return self.role == 'admin'
@@ -72,7 +103,7 @@ class User(db.Model):
             'email': self.email,
             'role': self.role,
             'is_active': self.is_active,
-            'has_face': self.face_encoding is not None,
+            'has_face': self.has_face,
             'has_password': self.password_hash is not None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'last_login': self.last_login.isoformat() if self.last_login else None
@@ -85,12 +116,18 @@ class User(db.Model):
 class AttendanceLog(db.Model):
     """Track user attendance/login sessions."""
     __tablename__ = 'attendance_logs'
+    __table_args__ = (
+        # A user's logs newest first, and their active session; both also
+        # serve plain user_id lookups
+        db.Index('ix_attendance_logs_user_id_login_time', 'user_id', 'login_time'),
+        db.Index('ix_attendance_logs_user_id_is_active_login_time', 'user_id', 'is_active', 'login_time'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     
     # Login/Logout times
-    login_time = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    login_time = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
     logout_time = db.Column(db.DateTime, nullable=True)
     
     # Login method and verification
@@ -103,7 +140,7 @@ class AttendanceLog(db.Model):
     user_agent = db.Column(db.String(255), nullable=True)
     
     # Status
-    is_active = db.Column(db.Boolean, default=True)  # Currently logged in
+    is_active = db.Column(db.Boolean, default=True, index=True)  # Currently logged in
     
     def duration_minutes(self):
         """Calculate session duration in minutes."""
@@ -134,6 +171,11 @@ class AttendanceLog(db.Model):
 class LoginAttempt(db.Model):
     """Track all login attempts for security monitoring."""
     __tablename__ = 'login_attempts'
+    __table_args__ = (
+        # Equality column first, so 'failed since X' is one range scan
+        db.Index('ix_login_attempts_success_timestamp', 'success', 'timestamp'),
+        db.Index('ix_login_attempts_user_id_timestamp', 'user_id', 'timestamp'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)  # Null if unknown user
@@ -173,16 +215,65 @@ def init_db(app):
     db.init_app(app)
     with app.app_context():
         db.create_all()
+        _create_missing_indexes()
+        _migrate_face_encodings()
         _create_default_admin()
         print("[OK] Database initialized successfully!")
 
 
+# Indexes replaced by ones declared on the models
+_OBSOLETE_INDEXES = ('ix_login_attempts_timestamp_success',)
+
+
+def _create_missing_indexes():
+    """Add indexes declared on the models to tables created before they existed."""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+    
+    with db.engine.begin() as conn:
+        for name in _OBSOLETE_INDEXES:
+            conn.execute(db.text(f"DROP INDEX IF EXISTS {name}"))
+
+
+def _migrate_face_encodings():
+    """Convert face encodings saved as JSON text to raw float32 bytes."""
+    # Only fetch legacy JSON rows ('[...]' as text or bytes), so startup does
+    # not read every 16 KB blob once the data has been converted
+    rows = db.session.execute(db.text(
+        "SELECT id, face_encoding FROM users "
+        "WHERE typeof(face_encoding) = 'text' "
+        "OR (substr(face_encoding, 1, 1) = X'5B' AND substr(face_encoding, -1, 1) = X'5D')"
+    )).all()
+    
+    migrated = 0
+    for user_id, value in rows:
+        # A float32 blob never ends in ']' (its last byte is an exponent byte)
+        if isinstance(value, bytes):
+            if not (value.startswith(b'[') and value.endswith(b']')):
+                continue
+            value = value.decode('utf-8')
+        
+        blob = np.asarray(json.loads(value), dtype='<f4').tobytes()
+        db.session.execute(
+            db.text("UPDATE users SET face_encoding = :blob WHERE id = :id"),
+            {'blob': blob, 'id': user_id}
+        )
+        migrated += 1
+    
+    if migrated:
+        db.session.commit()
+        print(f"[OK] Converted {migrated} face encoding(s) to binary format")
+
+
 def _create_default_admin():
     """Create default admin user if not exists."""
     from config import DEFAULT_ADMIN_USERNAME, DEFAULT_ADMIN_EMAIL, DEFAULT_ADMIN_PASSWORD, ROLE_ADMIN
+    from sqlalchemy.exc import IntegrityError
     
-    admin = User.query.filter_by(username=DEFAULT_ADMIN_USERNAME).first()
-    if not admin:
+    # Only the id is needed to know the admin exists, not a full User row
+    admin_id = db.session.query(User.id).filter_by(username=DEFAULT_ADMIN_USERNAME).scalar()
+    if admin_id is None:
         admin = User(
             username=DEFAULT_ADMIN_USERNAME,
             email=DEFAULT_ADMIN_EMAIL,
@@ -190,5 +281,10 @@ def _create_default_admin():
         )
         admin.set_password(DEFAULT_ADMIN_PASSWORD)
         db.session.add(admin)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another process starting at the same time created it first
+            db.session.rollback()
+            return
         print(f"[OK] Default admin user created: {DEFAULT_ADMIN_USERNAME}")
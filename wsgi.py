@@ -0,0 +1,25 @@
+"""
+WSGI entry point for production servers
+
+    gunicorn wsgi:app -w $(nproc) -k gthread --threads 8 --preload
+
+--preload imports the app (and loads the first face detector) once in the
+master process, so workers are forked with it already loaded. Each worker
+loads up to DETECTOR_POOL_SIZE more as its request threads need them.
+"""
+
+import os
+import sys
+
+# Add current directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app
+from models import db, init_db
+
+init_db(app)
+
+# init_db leaves a pooled SQLite connection open in this (master) process;
+# close it so forked workers each open their own instead of sharing it
+with app.app_context():
+    db.engine.dispose()